@@ -0,0 +1,126 @@
+"""Microbenchmark del router de comandos frente al recorrido lineal de handlers.
+
+Mide tres tipos de update con el mismo conjunto de handlers:
+- comando: el del último handler indexado (el peor caso del recorrido lineal);
+- conversación: texto dentro de la última conversación, ya activa;
+- sin índice: texto fuera de toda conversación, que sólo acepta el handler
+  no indexable registrado al final (el router recorre _no_indexados).
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.dispatch_bench
+"""
+import asyncio
+import datetime
+import timeit
+from telegram import Bot, Chat, Message, MessageEntity, Update, User
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+from utils.dispatcher import HandlerRegistry
+
+TAMANOS = [10, 50, 200, 1000]
+REPETICIONES = 20000
+
+
+async def _noop(update, context):
+    return None
+
+
+async def _entrar(update, context):
+    return 0
+
+
+def _crear_bot():
+    bot = Bot("123456:BENCHMARK")
+    bot._bot_user = User(id=123456, first_name="bench", is_bot=True, username="bench_bot")
+    return bot
+
+
+def _crear_update(bot, texto, update_id=1, user_id=1):
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    user = User(id=user_id, first_name="usuario", is_bot=False)
+    entities = []
+    if texto.startswith("/"):
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(texto.split()[0]))]
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(),
+        chat=chat,
+        from_user=user,
+        text=texto,
+        entities=entities,
+    )
+    message.set_bot(bot)
+    update = Update(update_id=update_id, message=message)
+    update.set_bot(bot)
+    return update
+
+
+def _crear_handlers(n):
+    """n handlers: mitad conversaciones, mitad comandos simples, y un eco de texto al final"""
+    handlers = []
+    for i in range(n):
+        if i % 2 == 0:
+            handlers.append(ConversationHandler(
+                entry_points=[CommandHandler(f"conv{i}", _entrar)],
+                states={0: [MessageHandler(filters.TEXT & ~filters.COMMAND, _noop)]},
+                fallbacks=[CommandHandler("cancelar", _noop)],
+            ))
+        else:
+            handlers.append(CommandHandler(f"cmd{i}", _noop))
+    handlers.append(MessageHandler(filters.TEXT & ~filters.COMMAND, _noop))
+    return handlers
+
+
+def _comando(handler):
+    if isinstance(handler, CommandHandler):
+        return next(iter(handler.commands))
+    return next(iter(handler.entry_points[0].commands))
+
+
+def _lineal(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+def _preparar(bot, n):
+    """Registra los handlers en un router y activa la última conversación del usuario 1"""
+    handlers = _crear_handlers(n)
+    application = Application.builder().bot(bot).build()
+    registry = HandlerRegistry(application)
+    registry.add_handlers(handlers)
+    router = registry.install()
+    application._initialized = True
+
+    ultima_conv = [h for h in handlers if isinstance(h, ConversationHandler)][-1]
+    asyncio.run(application.process_update(_crear_update(bot, f"/{_comando(ultima_conv)}")))
+
+    ultimo_indexado = handlers[-2]
+    updates = {
+        "comando": _crear_update(bot, f"/{_comando(ultimo_indexado)}", user_id=2),
+        "conversación": _crear_update(bot, "1500", user_id=1),
+        "sin índice": _crear_update(bot, "hola", user_id=2),
+    }
+    assert router.check_update(updates["conversación"])[0] is ultima_conv
+    assert router.check_update(updates["sin índice"])[0] is handlers[-1]
+    return handlers, router, updates
+
+
+def main():
+    bot = _crear_bot()
+    print(f"{'handlers':>8} {'update':>13} {'lineal (us)':>12} {'router (us)':>12}")
+    for n in TAMANOS:
+        handlers, router, updates = _preparar(bot, n)
+        for tipo, update in updates.items():
+            assert _lineal(handlers, update) is router.check_update(update)[0]
+
+            t_lineal = timeit.timeit(lambda: _lineal(handlers, update), number=REPETICIONES)
+            t_router = timeit.timeit(lambda: router.check_update(update), number=REPETICIONES)
+            print(f"{n:>8} {tipo:>13} {t_lineal / REPETICIONES * 1e6:>12.2f} "
+                  f"{t_router / REPETICIONES * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
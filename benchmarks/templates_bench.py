@@ -0,0 +1,92 @@
+"""Mide la memoria asignada por update en los pasos de capitalización.
+
+Para cada paso compara lo que hacía antes (construir el teclado y el texto en
+cada update) con lo que hace ahora el handler, usando sus mismas constantes.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.templates_bench
+"""
+import tracemalloc
+from telegram import ReplyKeyboardMarkup
+from handlers.capitalizacion import DESTINOS, HOJA, ORIGENES, RESUMEN_TEMPLATE
+from utils.autocomplete import teclado_sugerencias
+from utils.templates import TECLADO_SI_NO, teclado_opciones
+
+UPDATES = 10000
+
+DATOS = {
+    "monto": 1500.0,
+    "origen": "Fondos personales",
+    "destino": "Compra de café",
+    "concepto": "Lote_2 *urgente*",
+    "notas": "Ninguna",
+}
+
+
+def monto_antes():
+    """monto_step antes: teclado de orígenes nuevo en cada update"""
+    return ReplyKeyboardMarkup([[o] for o in ORIGENES], one_time_keyboard=True, resize_keyboard=True)
+
+
+def monto_ahora():
+    """monto_step ahora: teclado con sugerencias, cacheado por contenido"""
+    return teclado_opciones(teclado_sugerencias(HOJA, "origen", ORIGENES))
+
+
+def origen_antes():
+    return ReplyKeyboardMarkup([[d] for d in DESTINOS], one_time_keyboard=True, resize_keyboard=True)
+
+
+def origen_ahora():
+    return teclado_opciones(teclado_sugerencias(HOJA, "destino", DESTINOS))
+
+
+def notas_antes():
+    """notas_step antes: teclado Sí/No nuevo y resumen con f-strings"""
+    teclado = ReplyKeyboardMarkup([["Sí", "No"]], one_time_keyboard=True, resize_keyboard=True)
+    texto = (
+        "📝 *RESUMEN DE LA CAPITALIZACIÓN*\n\n"
+        f"Monto: {DATOS['monto']}\n"
+        f"Origen: {DATOS['origen']}\n"
+        f"Destino: {DATOS['destino']}\n"
+        f"Concepto: {DATOS['concepto']}\n"
+        f"Notas: {DATOS['notas']}\n\n"
+        "¿Confirmar esta capitalización?"
+    )
+    return teclado, texto
+
+
+def notas_ahora():
+    """notas_step ahora: teclado compartido y plantilla precompilada (con escape Markdown)"""
+    return TECLADO_SI_NO, RESUMEN_TEMPLATE.render(**DATOS)
+
+
+def medir(funcion):
+    """Bytes asignados (pico) por llamada, promediados sobre UPDATES llamadas"""
+    funcion()  # calentar cachés
+    tracemalloc.start()
+    total = 0
+    for _ in range(UPDATES):
+        antes = tracemalloc.get_traced_memory()[0]
+        resultado = funcion()
+        total += tracemalloc.get_traced_memory()[1] - antes
+        tracemalloc.reset_peak()
+        del resultado
+    tracemalloc.stop()
+    return total / UPDATES
+
+
+def main():
+    pasos = (
+        ("monto_step", monto_antes, monto_ahora),
+        ("origen_step", origen_antes, origen_ahora),
+        ("notas_step", notas_antes, notas_ahora),
+    )
+    print(f"{'paso':>12} {'antes (B)':>10} {'ahora (B)':>10}")
+    for nombre, antes, ahora in pasos:
+        print(f"{nombre:>12} {medir(antes):>10.0f} {medir(ahora):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 import os
+import asyncio
 import logging
-import traceback
 import requests
 from telegram.ext import Application, CommandHandler
 
-# Configuración de logging avanzada
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO  # Cambiado a INFO para reducir verbosidad
+from utils.logging_async import setup_logging, parse_sample_rates, instalar_contexto_log
+
+# Configuración de logging: los registros se formatean como JSON y se escriben
+# desde un hilo en segundo plano para no bloquear el event loop.
+# LOG_SAMPLING permite muestrear INFO por logger, p. ej. "handlers.capitalizacion=0.1"
+setup_logging(
+    level=logging.INFO,  # Cambiado a INFO para reducir verbosidad
+    sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLING", "")),
+    json_format=os.getenv("LOG_FORMAT", "json").lower() == "json"
 )
 logger = logging.getLogger(__name__)
 
@@ -19,6 +24,18 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 logger.info("Importando configuración...")
 from config import TOKEN, sheets_configured
 from utils.sheets import initialize_sheets
+from utils.dispatcher import HandlerRegistry
+from utils.autocomplete import cargar_historiales_pendientes
+from utils.resume import (
+    ResumeStore, STATE_FILE, PERSISTENCE_FILE, resume_store, install_resume, catch_up,
+    crear_persistencia, ruta_por_tenant
+)
+from utils.handover import (
+    HANDOVER_ENABLED, solicitar_handover, registrar_instancia, liberar_instancia, instalar_senal_handover
+)
+from utils.tenants import (
+    cargar_tenants, crear_loop_compartido, crear_request_compartido, instalar_tenant, run_tenants, tenant_actual
+)
 
 # Log inicial
 logger.info("=== INICIANDO BOT DE CAFE - MODO EMERGENCIA ===")
@@ -38,6 +55,7 @@ register_evidencias_list_handlers = None
 register_documento_emergency_handlers = None
 register_diagnostico_handlers = None
 register_capitalizacion_handlers = None  # Nuevo handler para capitalización
+register_autocomplete_handlers = None
 
 # Intentar importar handlers con captura de errores
 try:
@@ -50,69 +68,67 @@ try:
         from handlers.compras import register_compras_handlers
         logger.info("Handler de compras importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de compras: {e}")
+        logger.error("Error al importar handler de compras: %s", e)
     
     try:
         from handlers.proceso import register_proceso_handlers
         logger.info("Handler de proceso importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de proceso: {e}")
+        logger.error("Error al importar handler de proceso: %s", e)
     
     try:
         from handlers.gastos import register_gastos_handlers
         logger.info("Handler de gastos importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de gastos: {e}")
+        logger.error("Error al importar handler de gastos: %s", e)
     
     try:
         from handlers.ventas import register_ventas_handlers
         logger.info("Handler de ventas importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de ventas: {e}")
+        logger.error("Error al importar handler de ventas: %s", e)
     
     try:
         from handlers.reportes import register_reportes_handlers
         logger.info("Handler de reportes importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de reportes: {e}")
+        logger.error("Error al importar handler de reportes: %s", e)
     
     try:
         from handlers.pedidos import register_pedidos_handlers
         logger.info("Handler de pedidos importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de pedidos: {e}")
+        logger.error("Error al importar handler de pedidos: %s", e)
     
     try:
         from handlers.adelantos import register_adelantos_handlers
         logger.info("Handler de adelantos importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de adelantos: {e}")
+        logger.error("Error al importar handler de adelantos: %s", e)
     
     try:
         from handlers.compra_adelanto import register_compra_adelanto_handlers
         logger.info("Handler de compra_adelanto importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de compra_adelanto: {e}")
+        logger.error("Error al importar handler de compra_adelanto: %s", e)
     
     try:
         from handlers.almacen import register_almacen_handlers
         logger.info("Handler de almacen importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de almacen: {e}")
+        logger.error("Error al importar handler de almacen: %s", e)
     
     try:
         from handlers.evidencias import register_evidencias_handlers
         logger.info("Handler de evidencias importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de evidencias: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al importar handler de evidencias: %s", e, exc_info=True)
         
     try:
         from handlers.evidencias_list import register_evidencias_list_handlers
         logger.info("Handler de listado de evidencias importado correctamente")
     except Exception as e:
-        logger.error(f"Error al importar handler de listado de evidencias: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al importar handler de listado de evidencias: %s", e, exc_info=True)
     
     # NUEVO: Importar el módulo de capitalización
     try:
@@ -120,8 +136,13 @@ try:
         from handlers.capitalizacion import register_capitalizacion_handlers
         logger.info("Módulo de capitalización importado correctamente")
     except Exception as e:
-        logger.error(f"ERROR importando módulo de capitalización: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("ERROR importando módulo de capitalización: %s", e, exc_info=True)
+    
+    try:
+        from handlers.autocomplete import register_autocomplete_handlers
+        logger.info("Handler de autocompletado importado correctamente")
+    except Exception as e:
+        logger.error("Error al importar handler de autocompletado: %s", e)
     
     # NUEVO: Importar el módulo de emergencia para documentos
     try:
@@ -129,8 +150,7 @@ try:
         from handlers.documento_emergency import register_documento_emergency_handlers
         logger.info("Módulo de emergencia para documentos importado correctamente")
     except Exception as e:
-        logger.error(f"ERROR importando módulo de emergencia para documentos: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("ERROR importando módulo de emergencia para documentos: %s", e, exc_info=True)
     
     # Import del módulo de diagnóstico
     try:
@@ -138,34 +158,32 @@ try:
         from handlers.diagnostico import register_diagnostico_handlers
         logger.info("Módulo diagnostico importado correctamente")
     except Exception as e:
-        logger.error(f"ERROR importando módulo diagnostico: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("ERROR importando módulo diagnostico: %s", e, exc_info=True)
     
     logger.info("Todos los handlers importados correctamente")
     
 except Exception as e:
-    logger.error(f"ERROR importando handlers: {e}")
-    logger.error(traceback.format_exc())
+    logger.error("ERROR importando handlers: %s", e, exc_info=True)
 
-def eliminar_webhook():
+def eliminar_webhook(token=None):
     """Elimina cualquier webhook configurado antes de iniciar el polling"""
+    token = token or TOKEN
     try:
         logger.info("Eliminando webhook existente...")
-        url = f"https://api.telegram.org/bot{TOKEN}/deleteWebhook"
-        logger.info(f"Realizando solicitud a: {url.replace(TOKEN, TOKEN[:5] + '...')}")
+        url = f"https://api.telegram.org/bot{token}/deleteWebhook"
+        logger.info("Realizando solicitud a: %s", url.replace(token, token[:5] + '...'))
         
         response = requests.get(url)
-        logger.info(f"Respuesta del servidor: Código {response.status_code}")
+        logger.info("Respuesta del servidor: Código %s", response.status_code)
         
         if response.status_code == 200 and response.json().get("ok"):
             logger.info("Webhook eliminado correctamente")
             return True
         else:
-            logger.error(f"Error al eliminar webhook: {response.text}")
+            logger.error("Error al eliminar webhook: %s", response.text)
             return False
     except Exception as e:
-        logger.error(f"Excepción al eliminar webhook: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Excepción al eliminar webhook: %s", e, exc_info=True)
         return False
 
 def verificar_y_configurar_google_drive():
@@ -201,9 +219,9 @@ def verificar_y_configurar_google_drive():
                 
                 # Verificar que los IDs se hayan actualizado correctamente
                 from config import DRIVE_EVIDENCIAS_ROOT_ID, DRIVE_EVIDENCIAS_COMPRAS_ID, DRIVE_EVIDENCIAS_VENTAS_ID
-                logger.info(f"ID carpeta raíz: {DRIVE_EVIDENCIAS_ROOT_ID}")
-                logger.info(f"ID carpeta compras: {DRIVE_EVIDENCIAS_COMPRAS_ID}")
-                logger.info(f"ID carpeta ventas: {DRIVE_EVIDENCIAS_VENTAS_ID}")
+                logger.info("ID carpeta raíz: %s", DRIVE_EVIDENCIAS_ROOT_ID)
+                logger.info("ID carpeta compras: %s", DRIVE_EVIDENCIAS_COMPRAS_ID)
+                logger.info("ID carpeta ventas: %s", DRIVE_EVIDENCIAS_VENTAS_ID)
                 
                 return True
             else:
@@ -221,65 +239,49 @@ def verificar_y_configurar_google_drive():
             
             if service:
                 logger.info("✅ Conexión con Google Drive establecida correctamente")
-                logger.info(f"ID carpeta raíz: {DRIVE_EVIDENCIAS_ROOT_ID}")
-                logger.info(f"ID carpeta compras: {DRIVE_EVIDENCIAS_COMPRAS_ID}")
-                logger.info(f"ID carpeta ventas: {DRIVE_EVIDENCIAS_VENTAS_ID}")
+                logger.info("ID carpeta raíz: %s", DRIVE_EVIDENCIAS_ROOT_ID)
+                logger.info("ID carpeta compras: %s", DRIVE_EVIDENCIAS_COMPRAS_ID)
+                logger.info("ID carpeta ventas: %s", DRIVE_EVIDENCIAS_VENTAS_ID)
                 return True
             else:
                 logger.error("❌ No se pudo establecer conexión con Google Drive")
                 return False
     
     except Exception as e:
-        logger.error(f"Error al configurar Google Drive: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al configurar Google Drive: %s", e, exc_info=True)
         return False
 
-def main():
-    """Iniciar el bot"""
-    logger.info("Iniciando bot de Telegram para Gestión de Café en Heroku")
-    logger.info(f"Token encontrado (primeros 5 caracteres): {TOKEN[:5]}...")
-    
-    # Eliminar webhook existente primero
-    eliminar_webhook()
-    
-    # Verificar la configuración de Google Sheets
-    if sheets_configured:
-        logger.info("Inicializando Google Sheets...")
-        try:
-            initialize_sheets()
-            logger.info("Google Sheets inicializado correctamente")
-        except Exception as e:
-            logger.error(f"Error al inicializar Google Sheets: {e}")
-            logger.error(traceback.format_exc())
-            logger.warning("El bot continuará funcionando, pero los datos no se guardarán en Google Sheets")
-    
-    # Inicializar la configuración de Google Drive
-    drive_ok = verificar_y_configurar_google_drive()
-    if not drive_ok:
-        logger.warning("⚠️ Google Drive no está correctamente configurado. Las evidencias se guardarán localmente.")
-    else:
-        logger.info("✅ Google Drive configurado correctamente para el almacenamiento de evidencias.")
-    
+def crear_aplicacion(token, drive_ok, request=None, persistence=None):
+    """Crea la aplicación y registra todos los handlers; devuelve (application, registry, router)"""
     # Crear la aplicación
     try:
         logger.info("Creando aplicación con TOKEN...")
-        application = Application.builder().token(TOKEN).build()
+        builder = Application.builder().token(token)
+        if request is not None:
+            # Pool HTTP compartido entre tenants; getUpdates usa su propia conexión
+            builder = builder.request(request)
+        if persistence is not None:
+            # Estados de las conversaciones y user_data entre reinicios
+            builder = builder.persistence(persistence)
+        application = builder.build()
+        # Campos update_id/user_id/chat_id en los logs de cada update
+        instalar_contexto_log(application)
+        # Los handlers del grupo 0 se enrutan por comando / conversación activa
+        registry = HandlerRegistry(application)
         logger.info("Aplicación creada correctamente")
     except Exception as e:
-        logger.error(f"ERROR CRÍTICO al crear aplicación: {e}")
-        logger.error(traceback.format_exc())
-        return
+        logger.error("ERROR CRÍTICO al crear aplicación: %s", e, exc_info=True)
+        return None
     
     # Registrar comandos básicos
     try:
         logger.info("Registrando comandos básicos...")
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("ayuda", help_command))
-        application.add_handler(CommandHandler("help", help_command))
+        registry.add_handler(CommandHandler("start", start_command))
+        registry.add_handler(CommandHandler("ayuda", help_command))
+        registry.add_handler(CommandHandler("help", help_command))
         logger.info("Comandos básicos registrados correctamente")
     except Exception as e:
-        logger.error(f"Error al registrar comandos básicos: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al registrar comandos básicos: %s", e, exc_info=True)
     
     # Registrar handlers específicos
     handlers_registrados = 0
@@ -314,17 +316,18 @@ def main():
     # Añadir el nuevo handler de capitalización
     if register_capitalizacion_handlers:
         handler_functions.append(("capitalizacion", register_capitalizacion_handlers))
+    if register_autocomplete_handlers:
+        handler_functions.append(("autocomplete", register_autocomplete_handlers))
     
     # Registrar cada handler con manejo de excepciones individual
     for name, handler_func in handler_functions:
         try:
-            logger.info(f"Registrando handler: {name}...")
-            handler_func(application)
-            logger.info(f"Handler {name} registrado correctamente")
+            logger.info("Registrando handler: %s...", name)
+            handler_func(registry)
+            logger.info("Handler %s registrado correctamente", name)
             handlers_registrados += 1
         except Exception as e:
-            logger.error(f"Error al registrar handler {name}: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("Error al registrar handler %s: %s", name, e, exc_info=True)
             handlers_fallidos += 1
     
     # PRIORIDAD ALTA: Registrar el handler de emergencia para documentos
@@ -334,13 +337,12 @@ def main():
     if register_documento_emergency_handlers:
         try:
             logger.info("PRIORIDAD ALTA: Registrando handler de emergencia para documentos...")
-            register_documento_emergency_handlers(application)
+            register_documento_emergency_handlers(registry)
             logger.info("Handler de emergencia para documentos registrado correctamente")
             documento_handler_registrado = True
             handlers_registrados += 1
         except Exception as e:
-            logger.error(f"ERROR al registrar handler de emergencia para documentos: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("ERROR al registrar handler de emergencia para documentos: %s", e, exc_info=True)
             handlers_fallidos += 1
     
     # Si todavía no se ha registrado ningún handler para /documento, implementar una solución mínima
@@ -358,25 +360,23 @@ def main():
                     "Un administrador procesará tu evidencia manualmente."
                 )
             
-            application.add_handler(CommandHandler("documento", documento_minimo))
+            registry.add_handler(CommandHandler("documento", documento_minimo))
             logger.info("Handler mínimo para /documento implementado correctamente")
             documento_handler_registrado = True
             handlers_registrados += 1
         except Exception as e:
-            logger.error(f"Error al implementar handler mínimo para /documento: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("Error al implementar handler mínimo para /documento: %s", e, exc_info=True)
             handlers_fallidos += 1
     
     # Registrar handler de diagnóstico (con verificación especial)
     if register_diagnostico_handlers:
         try:
             logger.info("Registrando handler de diagnóstico...")
-            register_diagnostico_handlers(application)
+            register_diagnostico_handlers(registry)
             logger.info("Handler de diagnóstico registrado correctamente")
             handlers_registrados += 1
         except Exception as e:
-            logger.error(f"Error al registrar handler de diagnóstico: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("Error al registrar handler de diagnóstico: %s", e, exc_info=True)
             handlers_fallidos += 1
     else:
         logger.warning("No se pudo registrar el handler de diagnóstico: Módulo no disponible")
@@ -408,16 +408,15 @@ def main():
                     parse_mode="Markdown"
                 )
         
-        application.add_handler(CommandHandler("drive_status", drive_status))
+        registry.add_handler(CommandHandler("drive_status", drive_status))
         logger.info("Comando de estado de Google Drive registrado correctamente")
     except Exception as e:
-        logger.error(f"Error al registrar comando de estado de Google Drive: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al registrar comando de estado de Google Drive: %s", e, exc_info=True)
     
     # Registrar comando de test directo (sin usar el módulo documents)
     try:
         logger.info("Registrando comando de test directo...")
-        application.add_handler(
+        registry.add_handler(
             CommandHandler("test_bot", 
                 lambda update, context: update.message.reply_text(
                     "\ud83d\udc4d El bot está funcionando correctamente y puede recibir comandos.\n\n"
@@ -430,8 +429,7 @@ def main():
         )
         logger.info("Comando de test directo registrado correctamente")
     except Exception as e:
-        logger.error(f"Error al registrar comando de test directo: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al registrar comando de test directo: %s", e, exc_info=True)
     
     # Registrar comando de evidencia mínimo si el handler normal falló
     if "evidencias" not in [name for name, _ in handler_functions]:
@@ -448,35 +446,214 @@ def main():
                     "Un administrador procesará tu evidencia manualmente."
                 )
             
-            application.add_handler(CommandHandler("evidencia", evidencia_minimo))
+            registry.add_handler(CommandHandler("evidencia", evidencia_minimo))
             logger.info("Handler mínimo para /evidencia implementado correctamente")
             handlers_registrados += 1
         except Exception as e:
-            logger.error(f"Error al implementar handler mínimo para /evidencia: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("Error al implementar handler mínimo para /evidencia: %s", e, exc_info=True)
             handlers_fallidos += 1
     
     # Resumen de registro de handlers
-    logger.info(f"Resumen de registro de handlers: {handlers_registrados} éxitos, {handlers_fallidos} fallos")
-    logger.info(f"Estado del handler de documentos: {'REGISTRADO' if documento_handler_registrado else 'NO REGISTRADO'}")
-    logger.info(f"Estado de Google Drive: {'ACTIVO' if drive_ok else 'INACTIVO'}")
+    logger.info("Resumen de registro de handlers: %s éxitos, %s fallos", handlers_registrados, handlers_fallidos)
+    logger.info("Estado del handler de documentos: %s", 'REGISTRADO' if documento_handler_registrado else 'NO REGISTRADO')
+    logger.info("Estado de Google Drive: %s", 'ACTIVO' if drive_ok else 'INACTIVO')
     
     # Si todos los handlers fallaron, salir
     if handlers_registrados == 0 and handlers_fallidos > 0:
         logger.error("No se pudo registrar ningún handler. Finalizando inicialización.")
+        return None
+    
+    # Instalar el router de comandos como único handler del grupo 0
+    try:
+        router = registry.install()
+    except Exception as e:
+        logger.error("Error al instalar el router de comandos: %s", e, exc_info=True)
+        return None
+    
+    return application, registry, router
+
+async def precalentar(application, tenant=None):
+    """Trabajo previo al relevo: conexión con Telegram (get_me) e historial de autocompletado.
+
+    Tras el relevo sólo quedan leer los archivos de estado, el catch-up y el
+    polling; Application.initialize() ya no repite get_me.
+    """
+    if tenant is not None:
+        tenant_actual.set(tenant)
+    try:
+        await application.bot.initialize()
+    except Exception as e:
+        logger.error("No se pudo conectar con Telegram antes del relevo: %s", e)
+    # Historial de autocompletado: lecturas de Sheets en el pool de hilos
+    await cargar_historiales_pendientes()
+
+def configurar_reanudacion(application, registry, store, proceso_unico=True):
+    """Restaura el estado guardado y prepara el catch-up y el guardado al apagar.
+
+    El registro de la instancia y la señal de relevo sólo se instalan con
+    BOT_HANDOVER activo. Con proceso_unico=False (modo multi-tenant) los
+    gestiona run_tenants para todo el proceso.
+    """
+    # Reanudar desde el último update procesado en lugar de descartar los pendientes
+    try:
+        logger.info("Cargando estado previo del bot...")
+        store.load()
+        install_resume(registry, store)
+        store.restore()
+        
+        async def post_init(app):
+            # initialize() ya cargó las conversaciones persistentes
+            registry.persistencia_cargada()
+            if proceso_unico and HANDOVER_ENABLED:
+                try:
+                    instalar_senal_handover(app.stop_running)
+                    registrar_instancia()
+                except Exception as e:
+                    logger.error("Error al registrar la instancia activa: %s", e)
+            logger.info("Procesando updates pendientes (catch-up)...")
+            try:
+                await catch_up(app, store)
+            except Exception as e:
+                logger.error("Error durante el catch-up: %s", e, exc_info=True)
+        
+        async def post_shutdown(app):
+            store.save()
+            if proceso_unico and HANDOVER_ENABLED:
+                liberar_instancia()
+        
+        application.post_init = post_init
+        application.post_shutdown = post_shutdown
+    except Exception as e:
+        logger.error("Error al configurar la reanudación: %s", e, exc_info=True)
+
+def run_tenant_mode(tenants, drive_ok):
+    """Ejecuta un bot por tenant en el mismo proceso, con pools y hilos compartidos"""
+    request = crear_request_compartido()
+    aplicaciones = []
+    
+    for tenant in tenants:
+        logger.info("Preparando tenant %s...", tenant.nombre)
+        tenant_actual.set(tenant)
+        try:
+            eliminar_webhook(tenant.token)
+            resultado = crear_aplicacion(
+                tenant.token, drive_ok, request=request,
+                persistence=crear_persistencia(ruta_por_tenant(PERSISTENCE_FILE, tenant.nombre))
+            )
+            if resultado is None:
+                logger.error("No se pudo crear la aplicación del tenant %s", tenant.nombre)
+                continue
+            application, registry, _ = resultado
+            instalar_tenant(application, tenant)
+            aplicaciones.append((tenant, application, registry))
+        except Exception as e:
+            logger.error("Error al preparar el tenant %s: %s", tenant.nombre, e, exc_info=True)
+        finally:
+            tenant_actual.set(None)
+    
+    if not aplicaciones:
+        logger.error("Ningún tenant pudo iniciarse. Finalizando.")
+        return
+    
+    # Todas las aplicaciones se preparan a la vez en el loop compartido, y
+    # después se releva a la instancia anterior
+    loop = crear_loop_compartido()
+    loop.run_until_complete(asyncio.gather(*(
+        precalentar(application, tenant) for tenant, application, _ in aplicaciones
+    )))
+    try:
+        solicitar_handover()
+    except RuntimeError as e:
+        logger.error("%s. Finalizando.", e)
+        loop.close()
+        return
+    except Exception as e:
+        logger.error("Error durante el relevo de instancias: %s", e, exc_info=True)
+    
+    # Cada tenant guarda su offset y sesiones en sus propios archivos de estado
+    for tenant, application, registry in aplicaciones:
+        tenant_actual.set(tenant)
+        store = ResumeStore(ruta_por_tenant(STATE_FILE, tenant.nombre))
+        configurar_reanudacion(application, registry, store, proceso_unico=False)
+    tenant_actual.set(None)
+    
+    logger.info("Bot iniciado en modo MULTI-TENANT (%s tenants). Esperando comandos...", len(aplicaciones))
+    try:
+        loop.run_until_complete(run_tenants([(tenant, application) for tenant, application, _ in aplicaciones]))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+def main():
+    """Iniciar el bot"""
+    logger.info("Iniciando bot de Telegram para Gestión de Café en Heroku")
+    
+    # Modo multi-tenant si hay archivo de tenants (BOT_TENANTS_FILE)
+    try:
+        tenants = cargar_tenants()
+    except Exception as e:
+        logger.error("Error al leer la configuración de tenants: %s", e, exc_info=True)
+        return
+    
+    if not tenants:
+        logger.info("Token encontrado (primeros 5 caracteres): %s...", TOKEN[:5])
+        
+        # Eliminar webhook existente primero
+        eliminar_webhook()
+    
+    # Verificar la configuración de Google Sheets
+    if sheets_configured:
+        logger.info("Inicializando Google Sheets...")
+        try:
+            initialize_sheets()
+            logger.info("Google Sheets inicializado correctamente")
+        except Exception as e:
+            logger.error("Error al inicializar Google Sheets: %s", e, exc_info=True)
+            logger.warning("El bot continuará funcionando, pero los datos no se guardarán en Google Sheets")
+    
+    # Inicializar la configuración de Google Drive
+    drive_ok = verificar_y_configurar_google_drive()
+    if not drive_ok:
+        logger.warning("⚠️ Google Drive no está correctamente configurado. Las evidencias se guardarán localmente.")
+    else:
+        logger.info("✅ Google Drive configurado correctamente para el almacenamiento de evidencias.")
+    
+    if tenants:
+        run_tenant_mode(tenants, drive_ok)
         return
     
+    resultado = crear_aplicacion(TOKEN, drive_ok, persistence=crear_persistencia())
+    if resultado is None:
+        return
+    application, registry, _ = resultado
+    
+    # run_polling usa este mismo loop: el cliente HTTP ya inicializado sigue valiendo
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(precalentar(application))
+    
+    # Con BOT_HANDOVER=1, relevar a la instancia anterior ahora que esta ya está
+    # preparada: deja de recibir updates, termina sus handlers y guarda el estado
+    try:
+        solicitar_handover()
+    except RuntimeError as e:
+        logger.error("%s. Finalizando.", e)
+        loop.close()
+        return
+    except Exception as e:
+        logger.error("Error durante el relevo de instancias: %s", e, exc_info=True)
+    
+    configurar_reanudacion(application, registry, resume_store)
+    
     # Iniciar el bot
     try:
         logger.info("Bot iniciado en modo POLLING. Esperando comandos...")
-        application.run_polling(drop_pending_updates=True)
+        application.run_polling(drop_pending_updates=False)
     except Exception as e:
-        logger.error(f"Error al iniciar el bot: {e}")
-        logger.error(traceback.format_exc())
+        logger.error("Error al iniciar el bot: %s", e, exc_info=True)
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        logger.error(f"Error fatal en la ejecución del bot: {e}")
-        logger.error(traceback.format_exc())
\ No newline at end of file
+        logger.error("Error fatal en la ejecución del bot: %s", e, exc_info=True)
\ No newline at end of file
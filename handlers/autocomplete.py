@@ -0,0 +1,38 @@
+import logging
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.ext import ContextTypes, InlineQueryHandler
+from utils.autocomplete import get_index
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Máximo de sugerencias por consulta
+MAX_SUGERENCIAS = 10
+
+async def autocomplete_inline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Responde a consultas inline con sugerencias para el campo que el usuario está llenando"""
+    query = update.inline_query
+    campo_activo = context.user_data.get("autocompletar") if context.user_data is not None else None
+    
+    if not campo_activo:
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+    
+    hoja, campo = campo_activo
+    sugerencias = get_index(hoja, campo).sugerencias(query.query, MAX_SUGERENCIAS)
+    
+    # Al elegir una sugerencia se envía como mensaje normal, que recibe la conversación
+    resultados = [
+        InlineQueryResultArticle(
+            id=str(i),
+            title=valor,
+            input_message_content=InputTextMessageContent(valor)
+        )
+        for i, valor in enumerate(sugerencias)
+    ]
+    await query.answer(resultados, cache_time=0, is_personal=True)
+
+def register_autocomplete_handlers(application):
+    """Registra el handler de consultas inline para autocompletar campos"""
+    application.add_handler(InlineQueryHandler(autocomplete_inline))
+    logger.info("Handler de autocompletado registrado")
@@ -1,48 +1,78 @@
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update
 from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters, ContextTypes
 from utils.helpers import get_now_peru, format_date_for_sheets, safe_float
 from utils.sheets import append_data as append_sheets, generate_unique_id
+from utils.logging_async import fijar_contexto
+from utils.templates import Template, TECLADO_REMOVER, TECLADO_SI_NO, teclado_opciones
+from utils.resume import esperar_turno_escritura, resume_store
+from utils.tenants import TenantScopedDict
+from utils.autocomplete import (
+    activar_campo, desactivar_campo, get_index, programar_historial, registrar_valores, teclado_sugerencias
+)
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Nombre del handler para los logs estructurados
+HANDLER_NAME = "capitalizacion"
+
 # Estados para la conversación
 MONTO, ORIGEN, DESTINO, CONCEPTO, NOTAS, CONFIRMAR = range(6)
 
-# Datos temporales
-datos_capitalizacion = {}
+# Datos temporales (separados por tenant en modo multi-tenant)
+datos_capitalizacion = TenantScopedDict()
 
 # Opciones predefinidas
 ORIGENES = ["Fondos personales", "Préstamo bancario", "Inversionista", "Ganancias reinvertidas", "Otro"]
 DESTINOS = ["Compra de café", "Gastos operativos", "Equipo", "Expansión", "Otro"]
 
+# Campos con autocompletado a partir del historial de la hoja
+HOJA = "capitalizacion"
+CAMPOS_AUTOCOMPLETAR = ["origen", "destino", "concepto"]
+
+# Textos estáticos (se construyen una sola vez)
+MENSAJE_INICIO = (
+    "💰 *REGISTRO DE CAPITALIZACIÓN*\n\n"
+    "Vamos a registrar un nuevo ingreso de capital.\n\n"
+    "Por favor, ingresa el monto a capitalizar (solo el número):"
+)
+
+# Plantilla del resumen; los valores se escapan para Markdown al renderizar
+RESUMEN_TEMPLATE = Template(
+    "📝 *RESUMEN DE LA CAPITALIZACIÓN*\n\n"
+    "Monto: {monto}\n"
+    "Origen: {origen}\n"
+    "Destino: {destino}\n"
+    "Concepto: {concepto}\n"
+    "Notas: {notas}\n\n"
+    "¿Confirmar esta capitalización?"
+)
+
 async def capitalizacion_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Inicia el proceso de registro de capitalización"""
+    fijar_contexto(update, HANDLER_NAME, "INICIO")
     user_id = update.effective_user.id
-    logger.info(f"Usuario {user_id} inició comando /capitalizacion")
+    logger.info("Usuario %s inició comando /capitalizacion", user_id)
     
     # Inicializar datos para este usuario
     datos_capitalizacion[user_id] = {
         "registrado_por": update.effective_user.username or update.effective_user.first_name
     }
     
-    await update.message.reply_text(
-        "💰 *REGISTRO DE CAPITALIZACIÓN*\n\n"
-        "Vamos a registrar un nuevo ingreso de capital.\n\n"
-        "Por favor, ingresa el monto a capitalizar (solo el número):",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(MENSAJE_INICIO, parse_mode="Markdown")
     
     return MONTO
 
 async def monto_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Guarda el monto y solicita el origen de los fondos"""
+    fijar_contexto(update, HANDLER_NAME, "MONTO")
     user_id = update.effective_user.id
     
     try:
         monto = safe_float(update.message.text)
-        logger.info(f"Usuario {user_id} ingresó monto: {monto}")
+        logger.info("Usuario %s ingresó monto: %s", user_id, monto)
         
         if monto <= 0:
             await update.message.reply_text("El monto debe ser mayor que cero. Intenta nuevamente:")
@@ -51,18 +81,16 @@ async def monto_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         # Guardar el monto
         datos_capitalizacion[user_id]["monto"] = monto
         
-        # Crear teclado con opciones predefinidas para origen
-        keyboard = [[origen] for origen in ORIGENES]
-        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-        
+        # Teclado con los orígenes más usados y las opciones predefinidas
+        activar_campo(context, HOJA, "origen")
         await update.message.reply_text(
             f"Monto: {monto}\n\n"
             "Selecciona el origen de los fondos:",
-            reply_markup=reply_markup
+            reply_markup=teclado_opciones(teclado_sugerencias(HOJA, "origen", ORIGENES))
         )
         return ORIGEN
     except ValueError:
-        logger.warning(f"Usuario {user_id} ingresó un valor inválido para monto: {update.message.text}")
+        logger.warning("Usuario %s ingresó un valor inválido para monto: %s", user_id, update.message.text)
         await update.message.reply_text(
             "Por favor, ingresa un número válido para el monto."
         )
@@ -70,45 +98,48 @@ async def monto_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def origen_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Guarda el origen y solicita el destino de los fondos"""
+    fijar_contexto(update, HANDLER_NAME, "ORIGEN")
     user_id = update.effective_user.id
-    origen = update.message.text.strip()
-    logger.info(f"Usuario {user_id} seleccionó origen: {origen}")
+    origen = get_index(HOJA, "origen").canonico(update.message.text.strip())
+    logger.info("Usuario %s seleccionó origen: %s", user_id, origen)
     
     # Guardar el origen
     datos_capitalizacion[user_id]["origen"] = origen
     
-    # Crear teclado con opciones predefinidas para destino
-    keyboard = [[destino] for destino in DESTINOS]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-    
+    activar_campo(context, HOJA, "destino")
     await update.message.reply_text(
         f"Origen de fondos: {origen}\n\n"
         "Selecciona el destino/propósito de los fondos:",
-        reply_markup=reply_markup
+        reply_markup=teclado_opciones(teclado_sugerencias(HOJA, "destino", DESTINOS))
     )
     return DESTINO
 
 async def destino_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Guarda el destino y solicita el concepto"""
+    fijar_contexto(update, HANDLER_NAME, "DESTINO")
     user_id = update.effective_user.id
-    destino = update.message.text.strip()
-    logger.info(f"Usuario {user_id} seleccionó destino: {destino}")
+    destino = get_index(HOJA, "destino").canonico(update.message.text.strip())
+    logger.info("Usuario %s seleccionó destino: %s", user_id, destino)
     
     # Guardar el destino
     datos_capitalizacion[user_id]["destino"] = destino
     
+    # Sugerir los conceptos más usados, si hay historial
+    activar_campo(context, HOJA, "concepto")
+    sugerencias = teclado_sugerencias(HOJA, "concepto")
     await update.message.reply_text(
         f"Destino de fondos: {destino}\n\n"
         "Ingresa una descripción breve del motivo de la capitalización:",
-        reply_markup=ReplyKeyboardRemove()
+        reply_markup=teclado_opciones(sugerencias) if sugerencias else TECLADO_REMOVER
     )
     return CONCEPTO
 
 async def concepto_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Guarda el concepto y solicita notas adicionales"""
+    fijar_contexto(update, HANDLER_NAME, "CONCEPTO")
     user_id = update.effective_user.id
-    concepto = update.message.text.strip()
-    logger.info(f"Usuario {user_id} ingresó concepto: {concepto}")
+    concepto = get_index(HOJA, "concepto").canonico(update.message.text.strip())
+    logger.info("Usuario %s ingresó concepto: %s", user_id, concepto)
     
     # Verificar que no esté vacío
     if not concepto:
@@ -120,18 +151,21 @@ async def concepto_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     # Guardar el concepto
     datos_capitalizacion[user_id]["concepto"] = concepto
     
+    desactivar_campo(context)
     await update.message.reply_text(
         f"Concepto: {concepto}\n\n"
         "Si deseas, puedes añadir notas adicionales (opcional).\n"
-        "Si no deseas añadir notas, escribe 'ninguna':"
+        "Si no deseas añadir notas, escribe 'ninguna':",
+        reply_markup=TECLADO_REMOVER
     )
     return NOTAS
 
 async def notas_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Guarda las notas y muestra resumen para confirmación"""
+    fijar_contexto(update, HANDLER_NAME, "NOTAS")
     user_id = update.effective_user.id
     notas = update.message.text.strip()
-    logger.info(f"Usuario {user_id} ingresó notas: {notas}")
+    logger.info("Usuario %s ingresó notas: %s", user_id, notas)
     
     # Si el usuario escribe "ninguna", guardamos una cadena vacía
     if notas.lower() == "ninguna":
@@ -140,30 +174,27 @@ async def notas_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Guardar las notas
     datos_capitalizacion[user_id]["notas"] = notas
     
-    # Crear teclado para confirmación
-    keyboard = [["Sí", "No"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-    
     # Mostrar resumen para confirmar
     capData = datos_capitalizacion[user_id]
     await update.message.reply_text(
-        "📝 *RESUMEN DE LA CAPITALIZACIÓN*\n\n"
-        f"Monto: {capData['monto']}\n"
-        f"Origen: {capData['origen']}\n"
-        f"Destino: {capData['destino']}\n"
-        f"Concepto: {capData['concepto']}\n"
-        f"Notas: {notas if notas else 'Ninguna'}\n\n"
-        "¿Confirmar esta capitalización?",
+        RESUMEN_TEMPLATE.render(
+            monto=capData['monto'],
+            origen=capData['origen'],
+            destino=capData['destino'],
+            concepto=capData['concepto'],
+            notas=notas if notas else 'Ninguna'
+        ),
         parse_mode="Markdown",
-        reply_markup=reply_markup
+        reply_markup=TECLADO_SI_NO
     )
     return CONFIRMAR
 
 async def confirmar_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Confirma y guarda la capitalización"""
+    fijar_contexto(update, HANDLER_NAME, "CONFIRMAR")
     user_id = update.effective_user.id
     respuesta = update.message.text.lower()
-    logger.info(f"Usuario {user_id} respondió a confirmación: {respuesta}")
+    logger.info("Usuario %s respondió a confirmación: %s", user_id, respuesta)
     
     if respuesta in ["sí", "si", "s", "yes", "y"]:
         # Preparar datos para guardar
@@ -171,7 +202,7 @@ async def confirmar_step(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Generar un ID único para esta capitalización
         capitalizacion["id"] = generate_unique_id()
-        logger.info(f"Generado ID único para capitalización: {capitalizacion['id']}")
+        logger.info("Generado ID único para capitalización: %s", capitalizacion['id'])
         
         # Añadir fecha actualizada con formato protegido para Google Sheets
         now = get_now_peru()
@@ -184,16 +215,17 @@ async def confirmar_step(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         if not datos_completos:
             campos_faltantes = [campo for campo in campos_requeridos if campo not in capitalizacion]
-            logger.error(f"Datos incompletos para usuario {user_id}. Campos faltantes: {campos_faltantes}. Datos: {capitalizacion}")
+            logger.error("Datos incompletos para usuario %s. Campos faltantes: %s. Datos: %s", user_id, campos_faltantes, capitalizacion)
             await update.message.reply_text(
                 "❌ Error: Datos incompletos. Por favor, inicia el proceso nuevamente con /capitalizacion.",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=TECLADO_REMOVER
             )
             if user_id in datos_capitalizacion:
                 del datos_capitalizacion[user_id]
             return ConversationHandler.END
         
-        logger.info(f"Guardando capitalización en Google Sheets: {capitalizacion}")
+        logger.info("Guardando capitalización %s en Google Sheets", capitalizacion["id"])
+        logger.debug("Datos de capitalización: %s", capitalizacion)
         
         # Guardar la capitalización en Google Sheets
         try:
@@ -210,39 +242,43 @@ async def confirmar_step(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             }
             
             # Usar append_sheets para guardar en la hoja "capitalizacion"
-            result = append_sheets("capitalizacion", datos_limpios)
+            await esperar_turno_escritura()
+            # La escritura es bloqueante: se hace en el pool de hilos, no en el event loop
+            result = await asyncio.to_thread(append_sheets, "capitalizacion", datos_limpios)
             
             if result:
-                logger.info(f"Capitalización guardada exitosamente para usuario {user_id}")
+                # Actualizar el autocompletado con los valores recién guardados
+                registrar_valores(HOJA, datos_limpios, CAMPOS_AUTOCOMPLETAR)
+                logger.info("Capitalización guardada exitosamente para usuario %s", user_id)
                 
                 await update.message.reply_text(
                     "✅ ¡Capitalización registrada exitosamente!\n\n"
                     f"ID: {capitalizacion['id']}\n"
                     f"Monto: {capitalizacion['monto']}\n\n"
                     "Usa /capitalizacion para registrar otra capitalización.",
-                    reply_markup=ReplyKeyboardRemove()
+                    reply_markup=TECLADO_REMOVER
                 )
             else:
-                logger.error(f"Error al guardar capitalización: La función append_sheets devolvió False")
+                logger.error("Error al guardar capitalización: La función append_sheets devolvió False")
                 await update.message.reply_text(
                     "❌ Error al guardar la capitalización. Por favor, intenta nuevamente.\n\n"
                     "Contacta al administrador si el problema persiste.",
-                    reply_markup=ReplyKeyboardRemove()
+                    reply_markup=TECLADO_REMOVER
                 )
         except Exception as e:
-            logger.error(f"Error al guardar capitalización: {e}")
+            logger.error("Error al guardar capitalización: %s", e, exc_info=True)
             await update.message.reply_text(
                 "❌ Error al guardar la capitalización. Por favor, intenta nuevamente.\n\n"
                 f"Error: {str(e)}\n\n"
                 "Contacta al administrador si el problema persiste.",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=TECLADO_REMOVER
             )
     else:
-        logger.info(f"Usuario {user_id} canceló la capitalización")
+        logger.info("Usuario %s canceló la capitalización", user_id)
         await update.message.reply_text(
             "❌ Capitalización cancelada.\n\n"
             "Usa /capitalizacion para iniciar de nuevo.",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=TECLADO_REMOVER
         )
     
     # Limpiar datos temporales
@@ -253,25 +289,31 @@ async def confirmar_step(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancela la conversación"""
+    fijar_contexto(update, HANDLER_NAME, "CANCELAR")
     user_id = update.effective_user.id
-    logger.info(f"Usuario {user_id} canceló el proceso de capitalización con /cancelar")
+    logger.info("Usuario %s canceló el proceso de capitalización con /cancelar", user_id)
     
     # Limpiar datos temporales
     if user_id in datos_capitalizacion:
         del datos_capitalizacion[user_id]
+    desactivar_campo(context)
     
     await update.message.reply_text(
         "❌ Operación cancelada.\n\n"
         "Usa /capitalizacion para iniciar de nuevo cuando quieras.",
-        reply_markup=ReplyKeyboardRemove()
+        reply_markup=TECLADO_REMOVER
     )
     
     return ConversationHandler.END
 
 def register_capitalizacion_handlers(application):
     """Registra los handlers para el módulo de capitalización"""
+    # Construir los índices de autocompletado con el historial de la hoja (al iniciar, en post_init)
+    programar_historial(HOJA, CAMPOS_AUTOCOMPLETAR)
+    
     # Crear manejador de conversación
     conv_handler = ConversationHandler(
+        name="capitalizacion",
         entry_points=[CommandHandler("capitalizacion", capitalizacion_command)],
         states={
             MONTO: [MessageHandler(filters.TEXT & ~filters.COMMAND, monto_step)],
@@ -282,8 +324,13 @@ def register_capitalizacion_handlers(application):
             CONFIRMAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirmar_step)],
         },
         fallbacks=[CommandHandler("cancelar", cancelar)],
+        persistent=True,
     )
     
+    # Conservar los datos de las conversaciones en curso si el bot se reinicia
+    # (los estados los guarda la persistencia de PTB: persistent=True)
+    resume_store.registrar_datos("capitalizacion", datos_capitalizacion)
+    
     # Agregar el manejador al dispatcher
     application.add_handler(conv_handler)
     logger.info("Handler de capitalización registrado")
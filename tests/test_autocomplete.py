@@ -0,0 +1,57 @@
+import random
+from collections import Counter
+
+import pytest
+
+from utils.autocomplete import PREFIJO_CACHE, TOP_K, PrefixIndex, normalizar
+
+
+def _esperado(conteos, prefijo, limite):
+    """Conteos de las claves con el prefijo, de mayor a menor (fuerza bruta)"""
+    return sorted((c for clave, c in conteos.items() if clave.startswith(prefijo)), reverse=True)[:limite]
+
+
+@pytest.mark.parametrize("semilla", range(10))
+def test_top_k_coincide_con_fuerza_bruta(semilla):
+    rnd = random.Random(semilla)
+    indice = PrefixIndex()
+    conteos = Counter()
+    for paso in range(3000):
+        clave = "".join(rnd.choice("abc") for _ in range(rnd.randint(1, 6)))
+        indice.add(clave)
+        conteos[clave] += 1
+        if paso % 100 == 0:
+            for prefijo in ["", "a", "ab", "abc", "abca", "cc"]:
+                for limite in (1, 5, TOP_K, TOP_K + 5):
+                    obtenido = [conteos[normalizar(s)] for s in indice.sugerencias(prefijo, limite)]
+                    assert obtenido == _esperado(conteos, prefijo, limite), (prefijo, limite)
+
+
+def test_clave_que_supera_a_otra_sube_en_el_top_k():
+    indice = PrefixIndex(["abcd"] * 3 + ["abce"])
+    assert indice.sugerencias("ab") == ["abcd", "abce"]
+    for _ in range(3):
+        indice.add("abce")
+    for n in range(PREFIJO_CACHE + 1):
+        assert indice.sugerencias("abce"[:n]) == ["abce", "abcd"]
+    assert indice.sugerencias("abce") == ["abce"]
+
+
+def test_sin_tildes_ni_mayusculas():
+    indice = PrefixIndex(["Café Orgánico", "CAFE organico", "Cacao"])
+    assert len(indice) == 2
+    assert indice.sugerencias("cafe") == ["Café Orgánico"]
+    assert indice.sugerencias("CAFÉ  ORG") == ["Café Orgánico"]
+    assert indice.sugerencias("zz") == []
+
+
+def test_canonico_devuelve_la_forma_mas_usada():
+    indice = PrefixIndex(["Fondos personales", "fondos personales", "Fondos  personales"])
+    assert indice.canonico("FONDOS PERSONALES") == "Fondos personales"
+    assert indice.canonico("Nuevo origen") == "Nuevo origen"
+
+
+def test_ignora_vacios():
+    indice = PrefixIndex([None, "", "   "])
+    assert len(indice) == 0
+    assert indice.sugerencias("") == []
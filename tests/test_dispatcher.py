@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+import random
+
+import pytest
+from telegram import Bot, Chat, Message, MessageEntity, Update, User
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from utils.dispatcher import HandlerRegistry
+
+GRUPO = -100
+
+
+def _crear_bot():
+    bot = Bot("123456:TEST")
+    bot._bot_user = User(id=123456, first_name="test", is_bot=True, username="test_bot")
+    return bot
+
+
+def _crear_update(bot, update_id, user_id, texto, chat_id=GRUPO):
+    chat = Chat(id=chat_id, type=Chat.GROUP if chat_id < 0 else Chat.PRIVATE)
+    user = User(id=user_id, first_name=f"u{user_id}", is_bot=False)
+    entities = []
+    if texto.startswith("/"):
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(texto.split()[0]))]
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(),
+        chat=chat,
+        from_user=user,
+        text=texto,
+        entities=entities,
+    )
+    message.set_bot(bot)
+    update = Update(update_id=update_id, message=message)
+    update.set_bot(bot)
+    return update
+
+
+def _registrar(destino, log):
+    """Registra el mismo conjunto de handlers en una Application o un HandlerRegistry"""
+
+    def cb(nombre, estado=None):
+        async def callback(update, context):
+            log.append((update.update_id, nombre))
+            return estado
+        return callback
+
+    # No indexable registrado antes que los comandos: conserva su prioridad
+    destino.add_handler(MessageHandler(filters.Regex(r"^/prioridad"), cb("prioridad")))
+    destino.add_handler(CommandHandler("start", cb("start")))
+    destino.add_handler(CommandHandler("prioridad", cb("prioridad-cmd")))
+    # Conversación por chat (per_user=False): cualquier usuario del grupo la continúa
+    destino.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("cap", cb("cap", 0))],
+        states={0: [MessageHandler(filters.TEXT & ~filters.COMMAND, cb("cap-state", ConversationHandler.END))]},
+        fallbacks=[CommandHandler("cancelar", cb("cap-cancel", ConversationHandler.END))],
+        per_user=False,
+    ))
+    # Conversación por chat y usuario
+    destino.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("compra", cb("compra", 0))],
+        states={
+            0: [MessageHandler(filters.TEXT & ~filters.COMMAND, cb("compra-1", 1))],
+            1: [MessageHandler(filters.TEXT & ~filters.COMMAND, cb("compra-2", ConversationHandler.END))],
+        },
+        fallbacks=[CommandHandler("cancelar", cb("compra-cancel", ConversationHandler.END))],
+    ))
+    destino.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, cb("echo")))
+
+
+def _procesar(updates_spec, con_router):
+    async def run():
+        bot = _crear_bot()
+        app = Application.builder().bot(bot).build()
+        log = []
+        if con_router:
+            registry = HandlerRegistry(app)
+            _registrar(registry, log)
+            registry.install()
+        else:
+            _registrar(app, log)
+        app._initialized = True
+        for update_id, (user_id, texto, chat_id) in enumerate(updates_spec, start=1):
+            await app.process_update(_crear_update(bot, update_id, user_id, texto, chat_id))
+        return log
+
+    return asyncio.run(run())
+
+
+def _comparar(updates_spec):
+    assert _procesar(updates_spec, True) == _procesar(updates_spec, False)
+
+
+def test_conversacion_por_chat_la_continua_otro_usuario():
+    spec = [(1, "/cap", GRUPO), (2, "hola", GRUPO), (2, "otra", GRUPO)]
+    _comparar(spec)
+    assert _procesar(spec, True) == [(1, "cap"), (2, "cap-state"), (3, "echo")]
+
+
+def test_no_indexable_anterior_conserva_prioridad():
+    spec = [(1, "/prioridad", GRUPO), (1, "/start", GRUPO)]
+    _comparar(spec)
+    assert _procesar(spec, True) == [(1, "prioridad"), (2, "start")]
+
+
+@pytest.mark.parametrize("semilla", range(20))
+def test_equivalente_al_recorrido_lineal(semilla):
+    rnd = random.Random(semilla)
+    textos = ["/cap", "/compra", "/cancelar", "/start", "/prioridad", "hola", "123", "/otro"]
+    spec = [
+        (rnd.choice([1, 2, 3]), rnd.choice(textos), rnd.choice([GRUPO, 1, 2]))
+        for _ in range(40)
+    ]
+    _comparar(spec)
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import logging
+import queue
+
+from utils.logging_async import ContextoFilter, JsonFormatter, LazyQueueHandler, SamplingFilter, fijar_contexto
+
+
+class _Update:
+    update_id = 7
+    effective_user = type("U", (), {"id": 11})()
+    effective_chat = type("C", (), {"id": 22})()
+
+
+def _registro(nivel=logging.INFO, mensaje="m"):
+    return logging.LogRecord("prueba", nivel, __file__, 1, mensaje, None, None)
+
+
+def test_cola_llena_descarta_info_y_cuenta():
+    cola = queue.Queue(maxsize=2)
+    handler = LazyQueueHandler(cola)
+    for _ in range(5):
+        handler.handle(_registro())
+    assert cola.qsize() == 2
+    assert handler.descartados == 3
+
+    # Al vaciarse, el siguiente registro informa de lo perdido
+    cola.get_nowait()
+    handler.handle(_registro())
+    cola.get_nowait()
+    assert cola.get_nowait().descartados == 3
+
+
+def test_cola_llena_no_descarta_warning():
+    cola = queue.Queue(maxsize=1)
+    handler = LazyQueueHandler(cola)
+    handler.handle(_registro())
+    handler.handle(_registro())
+    assert handler.descartados == 1
+
+    # Un WARNING espera a que haya sitio en lugar de perderse
+    cola.get_nowait()
+    handler.handle(_registro(logging.WARNING))
+    assert cola.get_nowait().levelno == logging.WARNING
+
+
+def test_contexto_sale_en_el_json():
+    async def procesar():
+        fijar_contexto(_Update(), "capitalizacion", "MONTO")
+        registro = _registro()
+        ContextoFilter().filter(registro)
+        return json.loads(JsonFormatter().format(registro))
+
+    data = asyncio.run(procesar())
+    assert data["update_id"] == 7
+    assert data["user_id"] == 11
+    assert data["chat_id"] == 22
+    assert data["handler"] == "capitalizacion"
+    assert data["state"] == "MONTO"
+
+
+def test_muestreo_nunca_descarta_warning():
+    filtro = SamplingFilter({"prueba": 0.0})
+    assert not filtro.filter(_registro())
+    assert filtro.filter(_registro(logging.WARNING))
@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+from telegram import Bot, Chat, Message, Update, User
+from telegram.ext import Application, MessageHandler, filters
+
+from utils import resume
+from utils.dispatcher import HandlerRegistry
+from utils.resume import ResumeStore, catch_up, esperar_turno_escritura, install_resume
+
+
+@pytest.fixture(autouse=True)
+def datos_aislados(monkeypatch):
+    # Los diccionarios registrados son globales del módulo
+    monkeypatch.setattr(resume, "_datos_registrados", {})
+
+
+def _crear_update(bot, update_id, texto="hola", user_id=1):
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    user = User(id=user_id, first_name=f"u{user_id}", is_bot=False)
+    message = Message(message_id=update_id, date=datetime.datetime.now(), chat=chat, from_user=user, text=texto)
+    message.set_bot(bot)
+    update = Update(update_id=update_id, message=message)
+    update.set_bot(bot)
+    return update
+
+
+def _crear_bot(pendientes, llamadas):
+    """Bot cuyo get_updates sirve los update_id de pendientes a partir del offset"""
+
+    class BotFalso(Bot):
+        async def get_updates(self, offset=None, limit=100, timeout=None, **kwargs):
+            llamadas.append((offset, limit))
+            ids = [i for i in pendientes if offset is None or i >= offset]
+            return [_crear_update(self, i) for i in ids[:limit]]
+
+    bot = BotFalso("123456:TEST")
+    bot._bot_user = User(id=123456, first_name="test", is_bot=True, username="test_bot")
+    return bot
+
+
+def _crear_app(bot, store, log, escribe=()):
+    app = Application.builder().bot(bot).build()
+    registry = HandlerRegistry(app)
+
+    async def handler(update, context):
+        if update.update_id in escribe:
+            await esperar_turno_escritura()
+        log.append(update.update_id)
+
+    registry.add_handler(MessageHandler(filters.TEXT, handler))
+    registry.install()
+    install_resume(registry, store)
+    app._initialized = True
+    return app
+
+
+def test_marcar_aplicado_olvida_los_mas_antiguos(monkeypatch):
+    monkeypatch.setattr(resume, "MAX_IDS_RECORDADOS", 3)
+    store = ResumeStore("no-se-usa.json")
+    for update_id in [5, 1, 2, 3]:
+        store.marcar_aplicado(update_id)
+    store.marcar_aplicado(2)
+
+    assert not store.ya_aplicado(5)
+    assert all(store.ya_aplicado(i) for i in (1, 2, 3))
+    # last_update_id es el mayor visto, aunque ya no esté en el índice
+    assert store.last_update_id == 5
+
+
+def test_save_load_restore(tmp_path):
+    path = str(tmp_path / "estado.json")
+    datos = {123: {"monto": 10.0}, -45: {"monto": 1.0}, "clave": 1}
+    store = ResumeStore(path)
+    store.registrar_datos("capitalizacion", datos)
+    for update_id in (7, 8, 9):
+        store.marcar_aplicado(update_id)
+    store.save()
+
+    datos_nuevos = {}
+    nuevo = ResumeStore(path)
+    nuevo.registrar_datos("capitalizacion", datos_nuevos)
+    assert nuevo.load()
+    nuevo.restore()
+
+    assert nuevo.last_update_id == 9
+    assert all(nuevo.ya_aplicado(i) for i in (7, 8, 9))
+    # Las claves de user_id (incluidos chats negativos) vuelven a ser int
+    assert datos_nuevos == datos
+
+
+def test_load_sin_archivo_o_invalido(tmp_path):
+    assert not ResumeStore(str(tmp_path / "no-existe.json")).load()
+    invalido = tmp_path / "invalido.json"
+    invalido.write_text("{", encoding="utf-8")
+    assert not ResumeStore(str(invalido)).load()
+
+
+def test_duplicado_no_se_procesa_dos_veces(tmp_path):
+    log = []
+
+    async def run():
+        bot = _crear_bot([], [])
+        store = ResumeStore(str(tmp_path / "estado.json"))
+        app = _crear_app(bot, store, log)
+        for update_id in (1, 2, 1, 2, 3):
+            await app.process_update(_crear_update(bot, update_id))
+        return store
+
+    store = asyncio.run(run())
+    assert log == [1, 2, 3]
+    assert store.last_update_id == 3
+
+
+def test_catch_up_por_lotes_descarta_aplicados_y_confirma_offset(tmp_path, monkeypatch):
+    monkeypatch.setattr(resume, "CATCHUP_LOTE", 3)
+    path = str(tmp_path / "estado.json")
+    # Telegram puede volver a entregar un update (aquí el 12 y el 15)
+    pendientes = [9, 10, 11, 12, 12, 13, 14, 15, 15, 16]
+    llamadas = []
+    log = []
+
+    async def run():
+        bot = _crear_bot(pendientes, llamadas)
+        store = ResumeStore(path)
+        for update_id in (9, 10):
+            store.marcar_aplicado(update_id)
+        app = _crear_app(bot, store, log)
+        return await catch_up(app, store)
+
+    procesados = asyncio.run(run())
+    assert log == [11, 12, 13, 14, 15, 16]
+    assert procesados == 6
+    # Lotes desde el último update_id guardado y confirmación final del offset
+    assert llamadas == [(11, 3), (13, 3), (16, 3), (17, 1)]
+    with open(path, encoding="utf-8") as f:
+        guardado = json.load(f)
+    assert guardado["last_update_id"] == 16
+    assert guardado["update_ids"] == list(range(9, 17))
+
+
+def test_catch_up_sin_estado_previo(tmp_path):
+    llamadas = []
+    log = []
+
+    async def run():
+        bot = _crear_bot([1, 2], llamadas)
+        store = ResumeStore(str(tmp_path / "estado.json"))
+        app = _crear_app(bot, store, log)
+        return await catch_up(app, store)
+
+    assert asyncio.run(run()) == 2
+    assert log == [1, 2]
+    assert llamadas[0] == (None, resume.CATCHUP_LOTE)
+    assert llamadas[-1] == (3, 1)
+
+
+def test_catch_up_limita_solo_las_escrituras(tmp_path, monkeypatch):
+    monkeypatch.setattr(resume, "CATCHUP_MAX_POR_SEGUNDO", 20.0)
+    log = []
+
+    async def run():
+        bot = _crear_bot(list(range(1, 41)), [])
+        store = ResumeStore(str(tmp_path / "estado.json"))
+        app = _crear_app(bot, store, log, escribe={10, 20, 30, 40})
+        inicio = asyncio.get_running_loop().time()
+        await catch_up(app, store)
+        return asyncio.get_running_loop().time() - inicio
+
+    duracion = asyncio.run(run())
+    assert log == list(range(1, 41))
+    # 4 escrituras espaciadas 0.05 s; las otras 36 no esperan
+    assert 0.14 <= duracion < 0.5
@@ -0,0 +1,30 @@
+import pytest
+
+from utils.templates import Template
+
+
+def test_escapa_markdown_de_los_valores():
+    plantilla = Template("Concepto: {concepto}")
+    assert plantilla.render(concepto="Lote_2 *urgente*") == "Concepto: Lote\\_2 \\*urgente\\*"
+
+
+def test_sin_escape_deja_el_valor_tal_cual():
+    plantilla = Template("¡Hola {nombre}!", escape=False)
+    assert plantilla.render(nombre="ana_*") == "¡Hola ana_*!"
+
+
+def test_literales_no_se_escapan():
+    plantilla = Template("*RESUMEN*\nNotas: {notas}")
+    assert plantilla.render(notas="_") == "*RESUMEN*\nNotas: \\_"
+
+
+def test_formato_y_conversion_como_str_format():
+    plantilla = Template("{monto:.2f} {x!r} {y:>4}", escape=False)
+    assert plantilla.render(monto=1500, x="a", y=7) == "1500.00 'a'    7"
+    assert plantilla.render(monto=1500, x="a", y=7) == "{monto:.2f} {x!r} {y:>4}".format(monto=1500, x="a", y=7)
+
+
+@pytest.mark.parametrize("texto", ["{}", "{0}", "{a.b}", "{a[0]}", "{a:{ancho}}"])
+def test_campos_no_admitidos(texto):
+    with pytest.raises(ValueError):
+        Template(texto)
@@ -0,0 +1,181 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import unicodedata
+from utils.tenants import nombre_tenant
+
+logger = logging.getLogger(__name__)
+
+# Prefijos de hasta esta longitud (incluido el vacío) mantienen su top-k
+# actualizado en cada add(); los más largos se resuelven sobre el rango ordenado
+PREFIJO_CACHE = 3
+TOP_K = 10
+
+# Máximo de claves que se ordenan por frecuencia en una búsqueda sin caché
+MAX_RANGO = 2000
+
+
+def normalizar(texto):
+    """Clave de búsqueda: sin tildes, minúsculas y espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.casefold().split())
+
+
+class PrefixIndex:
+    """Índice de prefijos sobre un arreglo ordenado de claves normalizadas.
+
+    Cada clave guarda cuántas veces se usó y la forma escrita más frecuente,
+    que es la que se sugiere. Para los prefijos cortos (los que más claves
+    comparten, incluido el vacío de los teclados) se mantiene una lista top-k
+    en cada add(), así la consulta no depende del número de claves. Los
+    prefijos más largos usan dos bisect y ordenan como mucho MAX_RANGO claves.
+    """
+
+    def __init__(self, valores=()):
+        self._claves = []
+        self._conteos = {}
+        self._formas = {}
+        self._top = {}
+        for valor in valores:
+            self.add(valor)
+
+    def __len__(self):
+        return len(self._claves)
+
+    def add(self, valor):
+        """Registra un uso del valor (actualización incremental)"""
+        if valor is None:
+            return
+        valor = " ".join(str(valor).split())
+        clave = normalizar(valor)
+        if not clave:
+            return
+        if clave not in self._conteos:
+            bisect.insort(self._claves, clave)
+            self._conteos[clave] = 0
+            self._formas[clave] = {}
+        self._conteos[clave] += 1
+        formas = self._formas[clave]
+        formas[valor] = formas.get(valor, 0) + 1
+        self._actualizar_top(clave)
+
+    def _actualizar_top(self, clave):
+        """Reubica la clave en el top-k de cada uno de sus prefijos cortos.
+
+        Los conteos sólo crecen, así que una clave que no entra en un top-k
+        sólo puede entrar más adelante al volver a usarse, y pasa por aquí.
+        """
+        conteo = self._conteos[clave]
+        for n in range(min(len(clave), PREFIJO_CACHE) + 1):
+            top = self._top.setdefault(clave[:n], [])
+            if clave in top:
+                top.remove(clave)
+            elif len(top) >= TOP_K and self._conteos[top[-1]] >= conteo:
+                continue
+            i = 0
+            while i < len(top) and self._conteos[top[i]] >= conteo:
+                i += 1
+            top.insert(i, clave)
+            del top[TOP_K:]
+
+    def _forma(self, clave):
+        formas = self._formas[clave]
+        return max(formas, key=formas.get)
+
+    def canonico(self, valor):
+        """Devuelve la forma conocida de un valor ya usado, o el valor tal cual"""
+        clave = normalizar(valor)
+        if clave in self._formas:
+            return self._forma(clave)
+        return valor
+
+    def sugerencias(self, prefijo="", limite=5):
+        """Valores que empiezan por el prefijo, ordenados por frecuencia de uso"""
+        prefijo = normalizar(prefijo)
+        if len(prefijo) <= PREFIJO_CACHE and limite <= TOP_K:
+            return [self._forma(clave) for clave in self._top.get(prefijo, ())[:limite]]
+
+        inicio = bisect.bisect_left(self._claves, prefijo)
+        fin = bisect.bisect_left(self._claves, prefijo + "\U0010ffff", inicio)
+        fin = min(fin, inicio + MAX_RANGO)
+        claves = self._claves
+        conteos = self._conteos
+        mejores = heapq.nlargest(limite, range(inicio, fin), key=lambda i: conteos[claves[i]])
+        return [self._forma(claves[i]) for i in mejores]
+
+
+# Índices por (tenant, hoja, campo), compartidos por todos los handlers
+_indices = {}
+
+# Historiales por cargar al iniciar cada tenant: {tenant: [(hoja, campos)]}
+_pendientes = {}
+
+
+def get_index(hoja, campo):
+    """Obtiene (o crea vacío) el índice de un campo de una hoja del tenant actual"""
+    key = (nombre_tenant(), hoja, campo)
+    if key not in _indices:
+        _indices[key] = PrefixIndex()
+    return _indices[key]
+
+
+def registrar_valores(hoja, datos, campos):
+    """Actualiza los índices de los campos indicados con un registro nuevo"""
+    for campo in campos:
+        valor = datos.get(campo)
+        if valor:
+            get_index(hoja, campo).add(valor)
+
+
+def programar_historial(hoja, campos):
+    """Pide cargar el historial de una hoja al iniciar el bot (ver cargar_historiales_pendientes)"""
+    _pendientes.setdefault(nombre_tenant(), []).append((hoja, tuple(campos)))
+
+
+async def cargar_historiales_pendientes():
+    """Carga los historiales programados por el tenant actual, en paralelo y fuera del event loop"""
+    pendientes = _pendientes.pop(nombre_tenant(), [])
+    await asyncio.gather(*(cargar_historial(hoja, campos) for hoja, campos in pendientes))
+
+
+async def cargar_historial(hoja, campos):
+    """Construye los índices de una hoja a partir de sus registros históricos.
+
+    La lectura de Sheets es bloqueante y se hace en el pool de hilos. La hoja
+    es la del proceso, que sólo sirve a un tenant (ver tenants.MAX_TENANTS),
+    así que el historial es el del tenant actual.
+    """
+    try:
+        from utils.sheets import get_all_data
+        registros = await asyncio.to_thread(get_all_data, hoja)
+    except Exception as e:
+        logger.warning("No se pudo cargar el historial de %s para autocompletar: %s", hoja, e)
+        return 0
+
+    for registro in registros or []:
+        registrar_valores(hoja, registro, campos)
+    logger.info("Autocompletar: %s registros históricos cargados de %s", len(registros or []), hoja)
+    return len(registros or [])
+
+
+def teclado_sugerencias(hoja, campo, fijas=(), limite=5):
+    """Opciones para un teclado: las más usadas primero y luego las fijas"""
+    opciones = get_index(hoja, campo).sugerencias("", limite)
+    vistas = {normalizar(o) for o in opciones}
+    for opcion in fijas:
+        if normalizar(opcion) not in vistas:
+            opciones.append(opcion)
+            vistas.add(normalizar(opcion))
+    return tuple(opciones)
+
+
+def activar_campo(context, hoja, campo):
+    """Marca el campo que el usuario está escribiendo (lo usa el autocompletado inline)"""
+    context.user_data["autocompletar"] = (hoja, campo)
+
+
+def desactivar_campo(context):
+    """Quita la marca de campo activo del usuario"""
+    context.user_data.pop("autocompletar", None)
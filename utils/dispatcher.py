@@ -0,0 +1,255 @@
+import logging
+from telegram import MessageEntity, Update
+from telegram.ext import BaseHandler, CommandHandler, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Grupo donde se registran las conversaciones persistentes sólo durante
+# Application.initialize(), para que PTB cargue sus estados
+GRUPO_PERSISTENCIA = 100
+
+
+def _comando_de_update(update):
+    """Extrae el nombre del comando (sin '/' ni '@bot') si el mensaje empieza con uno"""
+    message = update.effective_message
+    if message is None or not message.text or not message.entities:
+        return None
+    entity = message.entities[0]
+    if entity.type != MessageEntity.BOT_COMMAND or entity.offset != 0:
+        return None
+    return message.text[1:entity.length].split("@", 1)[0].lower()
+
+
+def _clave_conversacion(conv, update):
+    """Clave de la conversación según per_chat/per_user del propio ConversationHandler"""
+    chat = update.effective_chat
+    user = update.effective_user
+    if (conv.per_chat and chat is None) or (conv.per_user and user is None):
+        return None
+    return (
+        conv.per_chat,
+        conv.per_user,
+        chat.id if conv.per_chat else None,
+        user.id if conv.per_user else None,
+    )
+
+
+def _comandos_de_handler(handler):
+    """Devuelve los comandos que pueden activar el handler, o None si no es indexable"""
+    if isinstance(handler, CommandHandler):
+        return handler.commands
+    if isinstance(handler, ConversationHandler):
+        # Las conversaciones por mensaje (callbacks) se revisan en orden, sin índice
+        if handler.per_message:
+            return None
+        comandos = set()
+        for entry in handler.entry_points:
+            if not isinstance(entry, CommandHandler):
+                return None
+            comandos.update(entry.commands)
+        return comandos
+    return None
+
+
+def _conversacion_activa(conv, update):
+    """Indica si la conversación del update sigue abierta en el ConversationHandler"""
+    try:
+        return conv._get_key(update) in conv._conversations
+    except Exception:
+        # Si no se puede determinar, mantener la pista; check_update la valida
+        return True
+
+
+class CommandRouter(BaseHandler):
+    """Handler frontal que enruta cada update sin recorrer todos los handlers.
+
+    Mantiene:
+    - un índice comando -> handlers (CommandHandler y ConversationHandler cuyos
+      entry points son todos comandos);
+    - un índice de conversaciones activas, con la clave que usa cada
+      ConversationHandler (chat y/o usuario según per_chat/per_user).
+
+    Sólo esos candidatos pueden aceptar el update entre los handlers indexados.
+    Para conservar la prioridad del grupo 0, un candidato gana únicamente si
+    ningún handler no indexable registrado antes que él acepta el update; si
+    no hay candidato, se revisan los no indexables en orden de registro. El
+    resultado es el mismo handler que elegiría el recorrido lineal.
+    """
+
+    def __init__(self):
+        super().__init__(self._sin_callback, block=True)
+        self.handlers = []
+        self._posicion = {}
+        self._por_comando = {}
+        self._no_indexados = []
+        self._conversaciones = []
+        self._formas = set()
+        self._duenos = {}
+
+    @staticmethod
+    async def _sin_callback(update, context):
+        return None
+
+    def add(self, handler):
+        """Añade un handler al router respetando el orden de registro"""
+        self._posicion[id(handler)] = len(self.handlers)
+        self.handlers.append(handler)
+        comandos = _comandos_de_handler(handler)
+        if comandos is None:
+            self._no_indexados.append(handler)
+            return
+        for comando in comandos:
+            self._por_comando.setdefault(comando.lower(), []).append(handler)
+        if isinstance(handler, ConversationHandler):
+            self._conversaciones.append(handler)
+            self._formas.add((handler.per_chat, handler.per_user))
+
+    def sync_owners(self):
+        """Reconstruye el índice de conversaciones activas (p. ej. tras cargar persistencia)"""
+        self._duenos = {}
+        for conv in self._conversaciones:
+            for key in conv._conversations:
+                key = tuple(key)
+                chat_id = key[0] if conv.per_chat else None
+                user_id = key[-1] if conv.per_user else None
+                clave = (conv.per_chat, conv.per_user, chat_id, user_id)
+                self._duenos.setdefault(clave, []).append(conv)
+
+    def _candidatos(self, update):
+        """Handlers indexados que podrían aceptar el update, en orden de registro"""
+        candidatos = []
+        chat = update.effective_chat
+        user = update.effective_user
+        for per_chat, per_user in self._formas:
+            if (per_chat and chat is None) or (per_user and user is None):
+                continue
+            clave = (per_chat, per_user, chat.id if per_chat else None, user.id if per_user else None)
+            candidatos.extend(self._duenos.get(clave, ()))
+        comando = _comando_de_update(update)
+        if comando is not None:
+            candidatos.extend(self._por_comando.get(comando, ()))
+        if len(candidatos) > 1:
+            candidatos = sorted(set(candidatos), key=lambda h: self._posicion[id(h)])
+        return candidatos
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return self._buscar_en(self._no_indexados, update)
+
+        ganador = None
+        for handler in self._candidatos(update):
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                ganador = (handler, check)
+                break
+
+        if ganador is None:
+            return self._buscar_en(self._no_indexados, update)
+
+        # Un no indexable registrado antes que el candidato tiene prioridad
+        limite = self._posicion[id(ganador[0])]
+        for handler in self._no_indexados:
+            if self._posicion[id(handler)] > limite:
+                break
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return handler, check
+        return ganador
+
+    @staticmethod
+    def _buscar_en(handlers, update):
+        for handler in handlers:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return handler, check
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        handler, check = check_result
+        coroutine = handler.handle_update(update, application, check, context)
+
+        if not handler.block:
+            application.create_task(coroutine, update=update)
+            return None
+
+        try:
+            return await coroutine
+        finally:
+            if isinstance(handler, ConversationHandler) and isinstance(update, Update):
+                self._actualizar_dueno(handler, update)
+
+    def _actualizar_dueno(self, conv, update):
+        # Sólo las conversaciones indexadas por comando necesitan la pista
+        if conv not in self._conversaciones:
+            return
+        clave = _clave_conversacion(conv, update)
+        if clave is None:
+            return
+        duenos = self._duenos.get(clave, [])
+        activa = _conversacion_activa(conv, update)
+        if activa and conv not in duenos:
+            duenos.append(conv)
+            self._duenos[clave] = duenos
+        elif not activa and conv in duenos:
+            duenos.remove(conv)
+            if not duenos:
+                del self._duenos[clave]
+
+
+class HandlerRegistry:
+    """Envoltorio de Application que recoge los handlers del grupo 0 en un CommandRouter.
+
+    Las funciones register_*_handlers reciben este objeto en lugar de la
+    aplicación; cualquier otro atributo se delega en la aplicación real.
+
+    PTB sólo carga y guarda los estados de los ConversationHandler con
+    persistent=True que encuentra en la aplicación al inicializarse. Por eso
+    install() los registra también en GRUPO_PERSISTENCIA, y
+    persistencia_cargada() los retira de ahí tras initialize(): PTB sigue
+    guardando sus estados y el router es el único que los atiende.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.router = CommandRouter()
+
+    def add_handler(self, handler, group=0):
+        if group != 0:
+            return self.application.add_handler(handler, group)
+        self.router.add(handler)
+        return None
+
+    def add_handlers(self, handlers, group=0):
+        if isinstance(handlers, dict):
+            for grupo, lista in handlers.items():
+                for handler in lista:
+                    self.add_handler(handler, grupo)
+        else:
+            for handler in handlers:
+                self.add_handler(handler, group)
+
+    def _conversaciones_persistentes(self):
+        return [
+            handler for handler in self.router.handlers
+            if isinstance(handler, ConversationHandler) and handler.persistent and handler.name
+        ]
+
+    def install(self):
+        """Registra el router como único handler del grupo 0"""
+        self.application.add_handler(self.router, 0)
+        if self.application.persistence:
+            for conv in self._conversaciones_persistentes():
+                self.application.add_handler(conv, GRUPO_PERSISTENCIA)
+        logger.info("Router de comandos instalado con %s handlers (%s comandos indexados)",
+                    len(self.router.handlers), len(self.router._por_comando))
+        return self.router
+
+    def persistencia_cargada(self):
+        """Llamar tras Application.initialize() y antes de procesar updates"""
+        for conv in self._conversaciones_persistentes():
+            if conv in self.application.handlers.get(GRUPO_PERSISTENCIA, ()):
+                self.application.remove_handler(conv, GRUPO_PERSISTENCIA)
+        self.router.sync_owners()
+
+    def __getattr__(self, name):
+        return getattr(self.application, name)
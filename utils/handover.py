@@ -0,0 +1,136 @@
+"""Relevo entre la instancia anterior del bot y la nueva, sin hueco sin polling.
+
+Usa un archivo PID y la señal SIGUSR1, así que las dos instancias deben
+correr en la misma máquina (mismo sistema de archivos y espacio de PIDs).
+No funciona entre dynos de Heroku ni entre contenedores separados: allí la
+instancia nueva no ve el PID de la anterior y BOT_HANDOVER debe quedar
+desactivado (la plataforma detiene el dyno anterior con SIGTERM).
+"""
+import asyncio
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+# Relevo entre instancias (opt-in): la nueva instancia se prepara por completo
+# y luego pide a la anterior que deje de recibir updates y guarde su estado
+HANDOVER_ENABLED = os.getenv("BOT_HANDOVER", "0").lower() in ("1", "true", "yes")
+PID_FILE = os.getenv("BOT_PID_FILE", "bot.pid")
+HANDOVER_TIMEOUT = float(os.getenv("BOT_HANDOVER_TIMEOUT", "60"))
+
+# Señal con la que se pide el relevo a la instancia activa
+HANDOVER_SIGNAL = getattr(signal, "SIGUSR1", None)
+
+
+def _leer_pid():
+    try:
+        with open(PID_FILE, encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _es_instancia_del_bot(pid):
+    """Evita enviar la señal a otro proceso que haya reutilizado el PID"""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"bot.py" in f.read()
+    except OSError:
+        # Sin /proc no se puede comprobar; se confía en el archivo PID
+        return True
+
+
+def _esperar(condicion):
+    """Espera hasta HANDOVER_TIMEOUT a que se cumpla la condición"""
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < HANDOVER_TIMEOUT:
+        if condicion():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def registrar_instancia():
+    """Marca este proceso como la instancia activa"""
+    with open(PID_FILE, "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    logger.info("Instancia activa registrada en %s (PID %s)", PID_FILE, os.getpid())
+
+
+def liberar_instancia():
+    """Borra el archivo PID si es nuestro; indica a la nueva instancia que el estado está guardado"""
+    if _leer_pid() == os.getpid():
+        try:
+            os.remove(PID_FILE)
+        except FileNotFoundError:
+            pass
+
+
+def solicitar_handover():
+    """Pide el relevo a la instancia activa y espera a que libere el estado.
+
+    Devuelve True si hubo relevo y False si no había otra instancia. Si la
+    instancia anterior no responde en HANDOVER_TIMEOUT se le envía SIGTERM;
+    si tampoco termina, lanza RuntimeError: dos procesos haciendo polling con
+    el mismo token sólo obtendrían errores Conflict, así que no se arranca.
+    """
+    if not HANDOVER_ENABLED or HANDOVER_SIGNAL is None:
+        return False
+
+    pid = _leer_pid()
+    if pid is None or pid == os.getpid() or not _proceso_vivo(pid) or not _es_instancia_del_bot(pid):
+        logger.info("No hay instancia activa a la que relevar")
+        return False
+
+    logger.info("Solicitando relevo a la instancia %s...", pid)
+    inicio = time.monotonic()
+    os.kill(pid, HANDOVER_SIGNAL)
+
+    # La instancia anterior borra el PID tras guardar offset y sesiones
+    if _esperar(lambda: _leer_pid() != pid or not _proceso_vivo(pid)):
+        logger.info("Relevo completado en %.1fs", time.monotonic() - inicio)
+        return True
+
+    logger.warning("La instancia %s no respondió en %ss; enviando SIGTERM", pid, HANDOVER_TIMEOUT)
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    if _esperar(lambda: not _proceso_vivo(pid)):
+        logger.info("La instancia %s terminó tras SIGTERM", pid)
+        return True
+
+    raise RuntimeError(f"La instancia {pid} sigue activa tras SIGTERM; no se inicia el polling")
+
+
+
+def instalar_senal_handover(detener):
+    """Al recibir HANDOVER_SIGNAL, llama a detener() para terminar ordenadamente.
+
+    Con run_polling, detener es application.stop_running: detiene el polling,
+    espera a los handlers en curso (incluidas sus escrituras en Sheets) y
+    ejecuta post_shutdown, que guarda el estado.
+    """
+    if HANDOVER_SIGNAL is None:
+        return
+
+    def _relevar():
+        logger.info("Relevo solicitado: dejando de recibir updates...")
+        detener()
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(HANDOVER_SIGNAL, _relevar)
+    except (NotImplementedError, RuntimeError) as e:
+        logger.warning("No se pudo instalar la señal de relevo: %s", e)
@@ -0,0 +1,243 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+# Campos estructurados: salen del contexto del update (ver fijar_contexto) o
+# de extra={...}
+CAMPOS_ESTRUCTURADOS = ("tenant", "update_id", "user_id", "chat_id", "handler", "state", "descartados")
+
+# Registros en espera de escribirse; con la cola llena se descartan los de
+# nivel inferior a WARNING
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Update que se está procesando: (update, handler, state). Se guarda tal cual y
+# sólo se convierte en campos para los registros que pasan el muestreo
+_contexto = contextvars.ContextVar("contexto_log", default=None)
+
+# Listener global (uno por proceso)
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON con los campos estructurados"""
+
+    def format(self, record):
+        data = {
+            "ts": "%s.%03d" % (
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+                record.msecs,
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for campo in CAMPOS_ESTRUCTURADOS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                data[campo] = valor
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea el mensaje en el hilo que registra.
+
+    El QueueHandler estándar llama a format() dentro de prepare(), es decir,
+    en el event loop. Aquí el registro se encola tal cual y el formateo
+    (mensaje, JSON y traceback) ocurre en el hilo del listener.
+
+    Consecuencia: los args se formatean más tarde y en otro hilo. No se deben
+    pasar objetos mutables que el event loop siga modificando (dicts o listas
+    vivos); en ese caso hay que pasar una copia, p. ej. dict(tenant.metricas).
+
+    La cola tiene tamaño máximo: si está llena (stdout lento), los registros
+    de nivel inferior a WARNING se descartan y se cuentan en descartados; el
+    siguiente registro encolado lleva en el campo "descartados" cuántos se
+    perdieron desde el anterior aviso.
+    Los WARNING y superiores esperan a que haya sitio.
+    """
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+        self._descartados_informados = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        pendientes = self.descartados - self._descartados_informados
+        if pendientes:
+            record.descartados = pendientes
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.descartados += 1
+                return
+            self.queue.put(record)
+        self._descartados_informados += pendientes
+
+
+class ContextoFilter(logging.Filter):
+    """Añade al registro los campos del update en curso (ver fijar_contexto).
+
+    Se instala después del muestreo: los registros descartados no pagan el
+    coste de construir los campos. Los valores pasados con extra={...} tienen
+    prioridad.
+    """
+
+    def filter(self, record):
+        from utils.tenants import nombre_tenant
+
+        if getattr(record, "tenant", None) is None:
+            record.tenant = nombre_tenant()
+        contexto = _contexto.get()
+        if contexto is None:
+            return True
+        update, handler, state = contexto
+        for campo, valor in _campos_update(update).items():
+            if getattr(record, campo, None) is None:
+                setattr(record, campo, valor)
+        if getattr(record, "handler", None) is None:
+            record.handler = handler
+        if getattr(record, "state", None) is None:
+            record.state = state
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Muestreo por logger para registros de nivel INFO o inferior.
+
+    rates es un diccionario {nombre_logger: fracción a conservar}. Se aplica la
+    entrada más específica (por prefijo con puntos). WARNING y superiores
+    nunca se descartan.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._cache = {}
+
+    def _rate_for(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            partes = name.split(".")
+            for i in range(len(partes), 0, -1):
+                prefijo = ".".join(partes[:i])
+                if prefijo in self.rates:
+                    rate = self.rates[prefijo]
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        return random.random() < rate
+
+
+def parse_sample_rates(texto):
+    """Convierte 'handlers.capitalizacion=0.1,httpx=0' en un diccionario de tasas"""
+    rates = {}
+    for parte in (texto or "").split(","):
+        parte = parte.strip()
+        if not parte or "=" not in parte:
+            continue
+        nombre, valor = parte.split("=", 1)
+        try:
+            rates[nombre.strip()] = max(0.0, min(1.0, float(valor)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(level=logging.INFO, sample_rates=None, stream=None, json_format=True):
+    """Configura el logging raíz para escribir desde un hilo en segundo plano.
+
+    Los registros pasan por una cola sin límite hacia un QueueListener que los
+    formatea y escribe en el stream. El event loop sólo paga el coste de crear
+    el LogRecord y encolarlo.
+    """
+    global _listener
+
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(stream)
+    if json_format:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+
+    cola = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = LazyQueueHandler(cola)
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+    queue_handler.addFilter(ContextoFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(cola, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Vacía la cola y detiene el hilo de escritura"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _campos_update(update):
+    campos = {}
+    if update is None:
+        return campos
+    campos["update_id"] = getattr(update, "update_id", None)
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        campos["user_id"] = user.id
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        campos["chat_id"] = chat.id
+    return campos
+
+
+def fijar_contexto(update, handler=None, state=None):
+    """Asocia los registros siguientes del update en curso a handler y state.
+
+    Sólo guarda referencias; los campos se construyen en ContextoFilter para
+    los registros que se escriben.
+    """
+    _contexto.set((update, handler, state))
+
+
+def instalar_contexto_log(application):
+    """Fija el contexto de log al empezar cada update (grupo -3, antes que el resto)"""
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    async def contexto_update(update, context):
+        fijar_contexto(update)
+
+    application.add_handler(TypeHandler(Update, contexto_update), -3)
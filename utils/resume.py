@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, PersistenceInput, PicklePersistence, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Archivo donde se guarda el estado entre reinicios
+STATE_FILE = os.getenv("BOT_STATE_FILE", "bot_state.json")
+
+# Los estados de las conversaciones y el user_data los guarda la persistencia
+# de PTB en este archivo
+PERSISTENCE_FILE = os.getenv("BOT_PERSISTENCE_FILE", "bot_conversaciones.pickle")
+
+# Cuántos update_id recientes se recuerdan para descartar duplicados
+MAX_IDS_RECORDADOS = 10000
+
+# Catch-up: tamaño de lote de getUpdates y escrituras en Google Sheets por
+# segundo como máximo, para no superar su cuota al vaciar el backlog
+CATCHUP_LOTE = 100
+CATCHUP_MAX_POR_SEGUNDO = float(os.getenv("CATCHUP_MAX_POR_SEGUNDO", "5"))
+
+# Intervalo mínimo entre escrituras del archivo de estado (segundos)
+INTERVALO_GUARDADO = 2.0
+
+# Limitador de escrituras activo mientras se procesa el catch-up (None fuera de él)
+_limite_catchup = contextvars.ContextVar("limite_catchup", default=None)
+
+# Diccionarios de datos temporales registrados por los handlers; son comunes a
+# todos los ResumeStore (en modo multi-tenant cada tenant ve sólo sus datos)
+_datos_registrados = {}
+
+
+class ResumeStore:
+    """Estado que sobrevive a un reinicio del bot.
+
+    Guarda en un archivo JSON el último update_id procesado, los update_id
+    recientes ya aplicados (índice de idempotencia) y los diccionarios de
+    datos temporales que registran los handlers. Los estados de los
+    ConversationHandler no se guardan aquí sino con la persistencia de PTB
+    (ver crear_persistencia).
+    """
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.last_update_id = 0
+        self._ids = set()
+        self._orden = deque()
+        self._datos = _datos_registrados
+        self._ultimo_guardado = 0.0
+        self._guardado_pendiente = None
+        self._cargado = {}
+
+    # Registro de lo que se persiste
+
+    def registrar_datos(self, nombre, datos):
+        """Persiste un diccionario de datos temporales {user_id: {...}}"""
+        self._datos[nombre] = datos
+
+    # Índice de idempotencia
+
+    def ya_aplicado(self, update_id):
+        return update_id in self._ids
+
+    def marcar_aplicado(self, update_id):
+        if update_id in self._ids:
+            return
+        self._ids.add(update_id)
+        self._orden.append(update_id)
+        while len(self._orden) > MAX_IDS_RECORDADOS:
+            self._ids.discard(self._orden.popleft())
+        if update_id > self.last_update_id:
+            self.last_update_id = update_id
+
+    # Serialización
+
+    def _snapshot(self):
+        return {
+            "last_update_id": self.last_update_id,
+            "update_ids": list(self._orden),
+            "datos": {
+                nombre: {str(k): v for k, v in datos.items()}
+                for nombre, datos in self._datos.items()
+            },
+        }
+
+    def _escribir(self, data):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        """Guarda el estado de forma síncrona (al apagar)"""
+        try:
+            self._escribir(self._snapshot())
+            self._ultimo_guardado = time.monotonic()
+        except Exception as e:
+            logger.error("Error al guardar el estado del bot: %s", e)
+
+    async def save_async(self):
+        """Guarda el estado sin bloquear el event loop, como mucho cada INTERVALO_GUARDADO"""
+        if self._guardado_pendiente is not None:
+            return
+        espera = INTERVALO_GUARDADO - (time.monotonic() - self._ultimo_guardado)
+
+        async def _guardar():
+            try:
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                data = self._snapshot()
+                await asyncio.to_thread(self._escribir, data)
+                self._ultimo_guardado = time.monotonic()
+            except Exception as e:
+                logger.error("Error al guardar el estado del bot: %s", e)
+            finally:
+                self._guardado_pendiente = None
+
+        self._guardado_pendiente = asyncio.create_task(_guardar())
+
+    def load(self):
+        """Lee el archivo de estado; devuelve False si no existe o no es válido"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._cargado = json.load(f)
+        except FileNotFoundError:
+            logger.info("No hay estado previo en %s; se inicia desde cero", self.path)
+            return False
+        except Exception as e:
+            logger.error("Error al leer el estado del bot: %s", e)
+            return False
+
+        self.last_update_id = int(self._cargado.get("last_update_id", 0))
+        for update_id in self._cargado.get("update_ids", []):
+            self.marcar_aplicado(int(update_id))
+        logger.info("Estado previo cargado: último update_id %s", self.last_update_id)
+        return True
+
+    def restore(self):
+        """Restaura los datos registrados a partir del estado cargado"""
+        for nombre, guardados in self._cargado.get("datos", {}).items():
+            datos = self._datos.get(nombre)
+            if datos is None:
+                continue
+            for k, v in guardados.items():
+                datos[int(k) if k.lstrip("-").isdigit() else k] = v
+
+
+class LimiteEscrituras:
+    """Espacia las escrituras para no pasar de por_segundo"""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0
+        self._siguiente = 0.0
+        self.esperas = 0
+
+    async def esperar(self):
+        if not self.intervalo:
+            return
+        ahora = time.monotonic()
+        turno = max(ahora, self._siguiente)
+        self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            self.esperas += 1
+            await asyncio.sleep(turno - ahora)
+
+
+async def esperar_turno_escritura():
+    """Los handlers lo llaman antes de escribir en Sheets.
+
+    Durante el catch-up limita las escrituras a CATCHUP_MAX_POR_SEGUNDO; el
+    resto de updates del backlog (pasos de conversación, consultas) no espera.
+    Fuera del catch-up no hace nada.
+    """
+    limite = _limite_catchup.get()
+    if limite is not None:
+        await limite.esperar()
+
+
+def ruta_por_tenant(path, nombre):
+    """Archivo propio de un tenant: bot_state.json -> bot_state.coop1.json"""
+    base, extension = os.path.splitext(path)
+    return f"{base}.{nombre}{extension}"
+
+
+def crear_persistencia(path=PERSISTENCE_FILE):
+    """Persistencia de PTB para las conversaciones con persistent=True y el user_data.
+
+    Se escribe cada INTERVALO_GUARDADO segundos (como el archivo de estado) y
+    al apagar, dentro de Application.shutdown().
+    """
+    return PicklePersistence(
+        filepath=path,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+        update_interval=INTERVALO_GUARDADO,
+    )
+
+
+def install_resume(registry, store):
+    """Añade los handlers de idempotencia (grupo -1) y de guardado (grupo 1)"""
+
+    async def descartar_duplicados(update, context):
+        if store.ya_aplicado(update.update_id):
+            logger.info("Update %s ya aplicado; se descarta", update.update_id)
+            raise ApplicationHandlerStop
+        # Se marca antes de procesar: una escritura en Sheets no se repite
+        # aunque el proceso muera a mitad del handler
+        store.marcar_aplicado(update.update_id)
+
+    async def guardar_estado(update, context):
+        await store.save_async()
+
+    registry.application.add_handler(TypeHandler(Update, descartar_duplicados), -1)
+    registry.application.add_handler(TypeHandler(Update, guardar_estado), 1)
+
+
+async def catch_up(application, store):
+    """Procesa el backlog acumulado durante el reinicio antes de empezar el polling.
+
+    Pide los updates en lotes desde el último update_id guardado y descarta los
+    ya aplicados. Sólo se limitan las escrituras en Sheets (ver
+    esperar_turno_escritura), así el polling no se retrasa por los updates
+    que no escriben.
+    """
+    offset = store.last_update_id + 1 if store.last_update_id else None
+    limite = LimiteEscrituras(CATCHUP_MAX_POR_SEGUNDO)
+    token = _limite_catchup.set(limite)
+    procesados = 0
+    descartados = 0
+    inicio = time.monotonic()
+
+    try:
+        while True:
+            updates = await application.bot.get_updates(offset=offset, limit=CATCHUP_LOTE, timeout=0)
+            if not updates:
+                break
+            for update in updates:
+                offset = update.update_id + 1
+                if store.ya_aplicado(update.update_id):
+                    descartados += 1
+                    continue
+                await application.process_update(update)
+                procesados += 1
+            if len(updates) < CATCHUP_LOTE:
+                break
+    finally:
+        _limite_catchup.reset(token)
+
+    if offset is not None:
+        # Confirmar a Telegram lo procesado para que el polling empiece después
+        await application.bot.get_updates(offset=offset, limit=1, timeout=0)
+    store.save()
+    logger.info("Catch-up completado: %s updates procesados, %s duplicados descartados, "
+                "%s escrituras demoradas en %.1fs",
+                procesados, descartados, limite.esperas, time.monotonic() - inicio)
+    return procesados
+
+
+# Instancia compartida: los handlers registran aquí sus datos temporales
+resume_store = ResumeStore()
@@ -0,0 +1,69 @@
+import string
+from functools import lru_cache
+from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.helpers import escape_markdown
+
+# Respuestas aceptadas para el teclado de confirmación
+OPCIONES_SI_NO = ("Sí", "No")
+
+_formatter = string.Formatter()
+
+
+class Template:
+    """Plantilla de mensaje precompilada.
+
+    El texto se analiza una sola vez al crear la plantilla; render() sólo
+    concatena los literales con los valores. Admite conversión y formato como
+    str.format ("{monto:.2f}", "{x!r}"), pero sólo campos con nombre y sin
+    atributos, índices ni formatos anidados; lo demás lanza ValueError al
+    crear la plantilla. Con escape=True los valores ya formateados se escapan
+    para parse_mode="Markdown", de modo que lo que escribe el usuario
+    (guiones bajos, asteriscos...) no rompe el mensaje.
+    """
+
+    __slots__ = ("texto", "escape", "_partes")
+
+    def __init__(self, texto, escape=True):
+        self.texto = texto
+        self.escape = escape
+        partes = []
+        for literal, campo, formato, conversion in _formatter.parse(texto):
+            if campo is not None:
+                if not campo.isidentifier():
+                    raise ValueError(f"Campo no admitido en la plantilla: {{{campo}}}")
+                if "{" in formato:
+                    raise ValueError(f"Formato anidado no admitido en la plantilla: {{{campo}:{formato}}}")
+            partes.append((literal, campo, formato, conversion))
+        self._partes = tuple(partes)
+
+    def render(self, **valores):
+        partes = []
+        for literal, campo, formato, conversion in self._partes:
+            partes.append(literal)
+            if campo is not None:
+                valor = valores[campo]
+                if conversion:
+                    valor = _formatter.convert_field(valor, conversion)
+                valor = format(valor, formato)
+                if self.escape:
+                    valor = escape_markdown(valor, version=1)
+                partes.append(valor)
+        return "".join(partes)
+
+
+@lru_cache(maxsize=256)
+def teclado_opciones(opciones, por_fila=1):
+    """Teclado de respuesta (una sola vez) para una tupla de opciones.
+
+    Los objetos de telegram son inmutables, así que el mismo teclado se
+    comparte entre todos los updates.
+    """
+    filas = [list(opciones[i:i + por_fila]) for i in range(0, len(opciones), por_fila)]
+    return ReplyKeyboardMarkup(filas, one_time_keyboard=True, resize_keyboard=True)
+
+
+# Teclado Sí/No compartido por todos los handlers
+TECLADO_SI_NO = teclado_opciones(OPCIONES_SI_NO, por_fila=2)
+
+# Quitar el teclado personalizado; también inmutable y compartido
+TECLADO_REMOVER = ReplyKeyboardRemove()
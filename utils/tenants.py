@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import signal
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import HTTPXRequest
+from utils.handover import HANDOVER_ENABLED, instalar_senal_handover, liberar_instancia, registrar_instancia
+
+logger = logging.getLogger(__name__)
+
+# Modo multi-tenant: un archivo JSON con una lista de cooperativas, p. ej.
+# [{"nombre": "coop1", "token": "...", "max_updates_por_minuto": 120}]
+# utils.sheets y utils.drive sólo usan la hoja de cálculo y las carpetas
+# globales, sin tenant; hasta que acepten IDs por cooperativa, se admite un
+# solo tenant por proceso para no mezclar sus registros
+TENANTS_FILE = os.getenv("BOT_TENANTS_FILE", "")
+
+# Hilos compartidos por todos los tenants para el trabajo bloqueante (Sheets, Drive)
+WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+
+# Cada cuánto se escriben las métricas por tenant en el log (segundos)
+INTERVALO_METRICAS = 300
+
+# Claves que utils.sheets y utils.drive no pueden respetar por tenant
+CLAVES_NO_SOPORTADAS = ("spreadsheet_id", "drive_folders")
+
+# Tenants por proceso mientras Sheets y Drive no separen los datos por tenant
+MAX_TENANTS = 1
+
+# Tenant del update que se está procesando; None en modo de un solo bot
+tenant_actual = contextvars.ContextVar("tenant_actual", default=None)
+
+
+class Tenant:
+    """Configuración, cuota y métricas de una cooperativa"""
+
+    def __init__(self, nombre, token, max_updates_por_minuto=0):
+        self.nombre = nombre
+        self.token = token
+        self.max_updates_por_minuto = max_updates_por_minuto
+        self.metricas = {"updates": 0, "errores": 0, "demorados": 0}
+        self._tokens = float(max_updates_por_minuto)
+        self._ultimo_relleno = time.monotonic()
+
+    def __repr__(self):
+        return f"Tenant({self.nombre})"
+
+    async def esperar_cuota(self):
+        """Token bucket por tenant: si se excede la cuota, espera sin afectar a otros tenants"""
+        if not self.max_updates_por_minuto:
+            return
+        por_segundo = self.max_updates_por_minuto / 60.0
+        ahora = time.monotonic()
+        self._tokens = min(
+            float(self.max_updates_por_minuto),
+            self._tokens + (ahora - self._ultimo_relleno) * por_segundo
+        )
+        self._ultimo_relleno = ahora
+        if self._tokens < 1:
+            self.metricas["demorados"] += 1
+            await asyncio.sleep((1 - self._tokens) / por_segundo)
+            self._tokens = 1
+            self._ultimo_relleno = time.monotonic()
+        self._tokens -= 1
+
+
+def nombre_tenant():
+    tenant = tenant_actual.get()
+    return tenant.nombre if tenant else None
+
+
+def cargar_tenants(path=TENANTS_FILE):
+    """Lee la configuración de tenants; lista vacía si no hay modo multi-tenant.
+
+    Lanza ValueError si hay más de MAX_TENANTS tenants o si alguno define su
+    propia hoja de cálculo o sus carpetas de Drive: Sheets y Drive sólo usan
+    la configuración global, así que los registros de varias cooperativas
+    (y su historial de autocompletado) acabarían mezclados en la misma hoja.
+    """
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    if len(data) > MAX_TENANTS:
+        raise ValueError(
+            f"{len(data)} tenants configurados, pero Sheets y Drive no separan los datos por "
+            f"tenant: se admite como máximo {MAX_TENANTS} por proceso. Ejecuta un proceso "
+            "por cooperativa, cada uno con su propia hoja y carpetas."
+        )
+
+    no_soportados = [
+        item.get("nombre", "?") for item in data
+        if any(item.get(clave) for clave in CLAVES_NO_SOPORTADAS)
+    ]
+    if no_soportados:
+        raise ValueError(
+            f"Los tenants {', '.join(no_soportados)} definen spreadsheet_id o drive_folders, "
+            "pero Sheets y Drive sólo usan la configuración global. Quita esas claves "
+            "y configura la hoja y las carpetas del proceso."
+        )
+
+    tenants = [
+        Tenant(
+            nombre=item["nombre"],
+            token=item["token"],
+            max_updates_por_minuto=item.get("max_updates_por_minuto", 0),
+        )
+        for item in data
+    ]
+    logger.info("Modo multi-tenant: %s tenants configurados", len(tenants))
+    return tenants
+
+
+class TenantScopedDict(MutableMapping):
+    """Diccionario de datos temporales separado por tenant.
+
+    Se usa igual que un dict; cada tenant ve sólo sus propias claves, así
+    un mismo user_id en dos cooperativas no comparte datos.
+    """
+
+    def __init__(self):
+        self._por_tenant = {}
+
+    def _actual(self):
+        return self._por_tenant.setdefault(nombre_tenant(), {})
+
+    def __getitem__(self, key):
+        return self._actual()[key]
+
+    def __setitem__(self, key, value):
+        self._actual()[key] = value
+
+    def __delitem__(self, key):
+        del self._actual()[key]
+
+    def __iter__(self):
+        return iter(self._actual())
+
+    def __len__(self):
+        return len(self._actual())
+
+
+def crear_request_compartido():
+    """Pool HTTP compartido por todos los bots para las llamadas a la API (no getUpdates)"""
+    return HTTPXRequest(connection_pool_size=256)
+
+
+def crear_loop_compartido():
+    """Event loop del proceso con el pool de hilos compartido por todos los tenants"""
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="bot-worker"))
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def instalar_tenant(application, tenant):
+    """Asocia el tenant a la aplicación: contexto, cuota y métricas por update"""
+    application.bot_data["tenant"] = tenant
+
+    async def preparar_update(update, context):
+        tenant_actual.set(tenant)
+        tenant.metricas["updates"] += 1
+        await tenant.esperar_cuota()
+
+    async def contar_error(update, context):
+        tenant.metricas["errores"] += 1
+        logger.error("Error en tenant %s: %s", tenant.nombre, context.error, exc_info=context.error)
+
+    application.add_handler(TypeHandler(Update, preparar_update), -2)
+    application.add_error_handler(contar_error)
+
+
+def log_metricas(tenants):
+    for tenant in tenants:
+        # Copia: el registro se formatea en el hilo de logging (ver LazyQueueHandler)
+        logger.info("Métricas tenant %s: %s", tenant.nombre, dict(tenant.metricas),
+                    extra={"handler": "tenants"})
+
+
+async def _iniciar_tenant(tenant, application):
+    """Inicia una aplicación; si falla a medias, la detiene y devuelve False.
+
+    El shutdown() de una aplicación fallida se deja para la fase final de
+    run_tenants: cerraría el pool HTTP que comparte con los demás tenants.
+    """
+    tenant_actual.set(tenant)
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_polling(drop_pending_updates=False)
+        await application.start()
+        logger.info("Tenant %s en ejecución", tenant.nombre)
+        return True
+    except Exception as e:
+        logger.error("No se pudo iniciar el tenant %s: %s", tenant.nombre, e, exc_info=True)
+        try:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+        except Exception as e:
+            logger.error("Error al detener el tenant %s tras el fallo: %s", tenant.nombre, e)
+        return False
+
+
+async def run_tenants(aplicaciones):
+    """Ejecuta varias Application en el mismo event loop hasta recibir SIGINT/SIGTERM.
+
+    aplicaciones es una lista de (tenant, application). Las aplicaciones se
+    inician a la vez (el catch-up de un tenant no retrasa a los demás) y cada
+    una hace polling por su cuenta; sus tareas heredan el tenant en el
+    contexto. Se ejecuta en el loop de crear_loop_compartido, que fija el
+    pool de hilos.
+    """
+    loop = asyncio.get_running_loop()
+
+    detener = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, detener.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    if HANDOVER_ENABLED:
+        instalar_senal_handover(detener.set)
+        registrar_instancia()
+
+    # Cada tarea de gather tiene su propia copia del contexto (y su tenant)
+    resultados = await asyncio.gather(*(
+        _iniciar_tenant(tenant, application) for tenant, application in aplicaciones
+    ))
+    iniciadas = [par for par, ok in zip(aplicaciones, resultados) if ok]
+    if not iniciadas:
+        logger.error("Ningún tenant pudo iniciarse")
+        detener.set()
+
+    tenants = [tenant for tenant, _ in iniciadas]
+    while not detener.is_set():
+        try:
+            await asyncio.wait_for(detener.wait(), timeout=INTERVALO_METRICAS)
+        except asyncio.TimeoutError:
+            log_metricas(tenants)
+
+    # Se detiene por fases: el pool HTTP es compartido, así que ningún bot se
+    # cierra hasta que todos hayan terminado sus handlers en curso
+    logger.info("Deteniendo %s tenants...", len(iniciadas))
+    for tenant, application in iniciadas:
+        tenant_actual.set(tenant)
+        try:
+            if application.updater.running:
+                await application.updater.stop()
+        except Exception as e:
+            logger.error("Error al detener el polling del tenant %s: %s", tenant.nombre, e)
+    for tenant, application in iniciadas:
+        tenant_actual.set(tenant)
+        try:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        except Exception as e:
+            logger.error("Error al detener el tenant %s: %s", tenant.nombre, e)
+    # También las que fallaron al iniciar: pueden haber quedado inicializadas
+    for tenant, application in aplicaciones:
+        tenant_actual.set(tenant)
+        try:
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+        except Exception as e:
+            logger.error("Error al cerrar el tenant %s: %s", tenant.nombre, e)
+    tenant_actual.set(None)
+
+    if HANDOVER_ENABLED:
+        liberar_instancia()
+    log_metricas(tenants)